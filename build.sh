@@ -2,6 +2,6 @@
 set -o errexit 
 pip install -r requirements.txt 
 python manage.py migrate 
-python manage.py shell -c "from main.import_csv import cargar; print(cargar())" 
+python manage.py import_products --sync 
 python manage.py seed
 python manage.py collectstatic --noinput
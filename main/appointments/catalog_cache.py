@@ -0,0 +1,107 @@
+"""Catálogo de sesiones (`Appointment`) cacheado para la página de servicios.
+
+La lista cambia muy de vez en cuando, así que se guarda ya calculada (precio
+efectivo, si el descuento está vigente y cuánto se ahorra) en la caché y,
+además, en memoria del proceso, así que una petición normal no toca ni la
+base de datos ni la caché salvo para leer el sello de versión. Se invalida al
+guardar o borrar una `Appointment` (señales en `models.py`), cambiando el
+sello, con lo que también se descarta la copia en memoria de los demás
+procesos. Caduca sola al llegar el `endDiscount` más cercano, momento en que
+cambia el precio de alguna sesión.
+"""
+import datetime
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from main.appointments.models import Appointment
+
+
+CATALOG_KEY = 'appointments:catalog'
+VERSION_KEY = 'appointments:catalog_version'
+
+# Sin descuentos pendientes de caducar se guarda como mucho un día
+MAX_TIMEOUT = 60 * 60 * 24
+
+# (sello de versión, catálogo) del último catálogo servido por este proceso
+_memo = None
+
+
+@dataclass(frozen=True)
+class AppointmentEntry:
+    """Sesión ya calculada; mismos nombres que `Appointment` para la plantilla."""
+    id: int
+    name: str
+    description: str
+    duration: int
+    premium: bool
+    price: Decimal
+    discount: Decimal
+    endDiscount: datetime.datetime
+    discount_active: bool
+    effective_price: Decimal
+    total_money_save: Decimal
+
+
+def build_catalog(now=None):
+    """Devuelve `{'entries': [...], 'expires_at': datetime | None}` calculado en `now`."""
+    now = now or timezone.now()
+    entries = []
+    expires_at = None
+    for appointment in Appointment.objects.order_by('pk'):
+        active = bool(appointment.endDiscount and appointment.endDiscount > now and appointment.discount is not None)
+        entries.append(AppointmentEntry(
+            id=appointment.pk,
+            name=appointment.name,
+            description=appointment.description,
+            duration=appointment.duration,
+            premium=appointment.premium,
+            price=appointment.price,
+            discount=appointment.discount,
+            endDiscount=appointment.endDiscount,
+            discount_active=active,
+            effective_price=appointment.discount if active else appointment.price,
+            total_money_save=appointment.price - appointment.discount if active else None,
+        ))
+        if active and (expires_at is None or appointment.endDiscount < expires_at):
+            expires_at = appointment.endDiscount
+    return {'entries': entries, 'expires_at': expires_at}
+
+
+def _expired(catalog, now):
+    return catalog['expires_at'] is not None and catalog['expires_at'] <= now
+
+
+def catalog_version():
+    return cache.get_or_set(VERSION_KEY, lambda: str(time.time_ns()), None)
+
+
+def get_catalog():
+    """Entradas del catálogo, desde memoria o desde la caché si siguen siendo válidas."""
+    global _memo
+    now = timezone.now()
+    version = catalog_version()
+    memo = _memo
+    if memo is not None and memo[0] == version and not _expired(memo[1], now):
+        return memo[1]['entries']
+
+    key = f'{CATALOG_KEY}:{version}'
+    catalog = cache.get(key)
+    # La caducidad de la caché va en segundos enteros: se comprueba también aquí
+    if catalog is None or _expired(catalog, now):
+        catalog = build_catalog(now)
+        timeout = MAX_TIMEOUT
+        if catalog['expires_at'] is not None:
+            timeout = max(min((catalog['expires_at'] - now).total_seconds(), MAX_TIMEOUT), 1)
+        cache.set(key, catalog, timeout)
+    _memo = (version, catalog)
+    return catalog['entries']
+
+
+def invalidate_catalog():
+    global _memo
+    _memo = None
+    cache.set(VERSION_KEY, str(time.time_ns()), None)
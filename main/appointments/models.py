@@ -1,5 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 class Appointment(models.Model):
     name = models.CharField(max_length=255, verbose_name="Name")
@@ -48,3 +50,10 @@ class Appointment(models.Model):
             
     def __str__(self):
         return self.name
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_catalog(sender, **kwargs):
+    from main.appointments import catalog_cache
+    catalog_cache.invalidate_catalog()
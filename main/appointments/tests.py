@@ -12,6 +12,12 @@ from django.contrib.auth.models import User
 from .models import Appointment
 from django.core.exceptions import ValidationError
 from unittest.mock import patch
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import catalog_cache
 
 
 class CreateAppointmentViewTests(TestCase):
@@ -371,4 +377,69 @@ class AppointmentsViewTests(TestCase):
 		qs = response.context['appointments']
 		names = {o.name for o in qs}
 		self.assertIn('A1', names)
-		self.assertIn('A2', names)
\ No newline at end of file
+		self.assertIn('A2', names)
+
+
+class AppointmentCatalogCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.now = timezone.now()
+
+	def _create(self, name, end=None):
+		return Appointment.objects.create(
+			name=name, price=Decimal('30.00'), duration=60, description='', premium=False,
+			discount=Decimal('20.00'), endDiscount=end,
+		)
+
+	def test_repeated_requests_are_served_from_cache(self):
+		self._create('A1')
+		self.client.get(reverse('appointments'))
+		with self.assertNumQueries(0):
+			entries = catalog_cache.get_catalog()
+		self.assertEqual([e.name for e in entries], ['A1'])
+
+	def test_hits_are_served_from_process_memory(self):
+		self._create('A1')
+		catalog_cache.get_catalog()
+		with patch.object(catalog_cache.cache, 'get', wraps=catalog_cache.cache.get) as cache_get:
+			entries = catalog_cache.get_catalog()
+		self.assertEqual([e.name for e in entries], ['A1'])
+		# Solo se lee el sello de versión, no el catálogo
+		self.assertEqual([c.args[0] for c in cache_get.call_args_list], [catalog_cache.VERSION_KEY])
+
+	def test_version_bump_from_another_process_discards_the_memo(self):
+		appointment = self._create('A1')
+		catalog_cache.get_catalog()
+
+		# Cambio hecho en otro proceso: este no recibe la señal, solo ve el sello nuevo
+		Appointment.objects.filter(pk=appointment.pk).update(price=Decimal('35.00'))
+		cache.set(catalog_cache.VERSION_KEY, 'otro-proceso', None)
+
+		self.assertEqual(catalog_cache.get_catalog()[0].price, Decimal('35.00'))
+
+	def test_save_and_delete_invalidate_the_catalog(self):
+		appointment = self._create('A1')
+		catalog_cache.get_catalog()
+
+		appointment.price = Decimal('35.00')
+		appointment.save()
+		self.assertEqual(catalog_cache.get_catalog()[0].price, Decimal('35.00'))
+
+		appointment.delete()
+		self.assertEqual(catalog_cache.get_catalog(), [])
+
+	def test_catalog_expires_at_nearest_end_discount(self):
+		self._create('Soon', end=self.now + timedelta(hours=1))
+		self._create('Later', end=self.now + timedelta(hours=3))
+
+		entries = catalog_cache.get_catalog()
+		self.assertEqual([e.discount_active for e in entries], [True, True])
+		self.assertEqual(entries[0].effective_price, Decimal('20.00'))
+		self.assertEqual(entries[0].total_money_save, Decimal('10.00'))
+		response = self.client.get(reverse('appointments'))
+		self.assertContains(response, 'Oferta')
+
+		with patch('django.utils.timezone.now', return_value=self.now + timedelta(hours=2)):
+			entries = catalog_cache.get_catalog()
+		self.assertEqual([e.discount_active for e in entries], [False, True])
+		self.assertEqual(entries[0].effective_price, Decimal('30.00'))
@@ -4,14 +4,12 @@ from django.db import connection
 from django.shortcuts import redirect, render
 from .models import Appointment
 from django.contrib.admin.views.decorators import staff_member_required
-from . import forms as appointment_forms
+from . import catalog_cache, forms as appointment_forms
 from django.utils import formats, timezone
 from django.core.exceptions import ValidationError
 
 def appointments(request):
-    appointments = Appointment.objects.all()
-    now = timezone.now()
-    return render(request, 'appointments.html', {'appointments': appointments, 'now': now})
+    return render(request, 'appointments.html', {'appointments': catalog_cache.get_catalog(), 'now': timezone.now()})
 
 @staff_member_required(login_url='appointments')
 def create_appointment(request):
@@ -0,0 +1,119 @@
+"""Paquetes de CSS (bundles) para `base.html`.
+
+Cada paquete de `settings.CSS_BUNDLES` concatena y minifica varias hojas de
+`static/` en `bundles/<nombre>.css`. `BundleFinder` los expone como un
+fichero estático más, así que:
+
+- en desarrollo se construyen al pedirlos (y se rehacen si cambia una
+  hoja de origen);
+- `collectstatic` los copia y el storage de WhiteNoise les pone hash en el
+  nombre y genera las variantes `.gz` (y `.br` si está instalado `Brotli`).
+  Un paquete u hoja que falte en el manifiesto es un error, no una URL sin
+  hash.
+
+Las plantillas los enlazan con `{% css_bundle 'nombre' %}`.
+"""
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.checks import Error
+from django.core.files.storage import FileSystemStorage
+
+
+BUNDLE_PREFIX = 'bundles'
+
+# Cadenas entre comillas (se copian tal cual) o comentarios (se quitan)
+_STRING_OR_COMMENT_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+_SPACE_RE = re.compile(r'\s+')
+_PUNCT_RE = re.compile(r'\s*([{};,])\s*')
+
+
+def _minify_code(text):
+    text = _SPACE_RE.sub(' ', text)
+    text = _PUNCT_RE.sub(r'\1', text)
+    return text.replace(';}', '}')
+
+
+def minify_css(text):
+    """Minificación conservadora: quita comentarios y espacios sobrantes.
+
+    Las cadenas entre comillas (`content: "a  b"`, `url("...")`) no se tocan.
+    """
+    parts = []
+    code = ''
+    pos = 0
+    for match in _STRING_OR_COMMENT_RE.finditer(text):
+        code += text[pos:match.start()]
+        pos = match.end()
+        if match.group(1) is None:
+            code += ' '
+            continue
+        parts.append(_minify_code(code))
+        parts.append(match.group(1))
+        code = ''
+    parts.append(_minify_code(code + text[pos:]))
+    return ''.join(parts).strip()
+
+
+def bundle_path(name):
+    return f'{BUNDLE_PREFIX}/{name}.css'
+
+
+def _bundles():
+    return getattr(settings, 'CSS_BUNDLES', {})
+
+
+def _build_dir():
+    return getattr(settings, 'CSS_BUNDLES_DIR', os.path.join(settings.BASE_DIR, '.cache', 'bundles'))
+
+
+def build_bundle(name):
+    """Escribe `bundles/<name>.css` si falta o está desactualizado y devuelve su ruta."""
+    sources = [finders.find(source) for source in _bundles()[name]]
+    missing = [source for source, path in zip(_bundles()[name], sources) if not path]
+    if missing:
+        raise FileNotFoundError(f"CSS bundle '{name}': no se encuentra {', '.join(missing)}")
+
+    target = os.path.join(_build_dir(), BUNDLE_PREFIX, f'{name}.css')
+    if os.path.exists(target) and os.path.getmtime(target) >= max(os.path.getmtime(p) for p in sources):
+        return target
+
+    parts = []
+    for source, path in zip(_bundles()[name], sources):
+        with open(path, encoding='utf-8') as f:
+            parts.append(f'/* {source} */\n{minify_css(f.read())}')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts) + '\n')
+    os.replace(tmp, target)
+    return target
+
+
+class BundleFinder(BaseFinder):
+    """Finder de staticfiles que sirve los paquetes de `CSS_BUNDLES`."""
+
+    def check(self, **kwargs):
+        errors = []
+        for name, sources in _bundles().items():
+            for source in sources:
+                if not finders.find(source):
+                    errors.append(Error(f"CSS bundle '{name}' references missing static file '{source}'.", id='main.E001'))
+        return errors
+
+    def find(self, path, find_all=False, **kwargs):
+        prefix = f'{BUNDLE_PREFIX}/'
+        name = path[len(prefix):-len('.css')] if path.startswith(prefix) and path.endswith('.css') else None
+        if name not in _bundles():
+            return []
+        target = build_bundle(name)
+        return [target] if find_all or kwargs.get('all') else target
+
+    def list(self, ignore_patterns):
+        storage = FileSystemStorage(location=_build_dir())
+        for name in _bundles():
+            build_bundle(name)
+            yield bundle_path(name), storage
@@ -0,0 +1,98 @@
+"""Variantes reducidas (WebP) de las imágenes subidas.
+
+Para cada imagen original (`products/batido.png`) se generan copias WebP de
+los anchos de `VARIANT_WIDTHS` junto a ella (`products/batido_320w.webp`),
+sin ampliar nunca el original. Las plantillas las ofrecen con `srcset`
+(etiqueta `image_srcset` de `main/templatetags/image_variants.py`) y
+mantienen el original en `src`.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+VARIANT_WIDTHS = (160, 320, 640)
+WEBP_QUALITY = 80
+
+
+def variant_name(name, width):
+    root, _ = os.path.splitext(name)
+    return f"{root}_{width}w.webp"
+
+
+def _is_local(name):
+    # Algunos productos antiguos guardan en `image` la URL remota
+    return bool(name) and not name.startswith("http")
+
+
+def _open(name, storage):
+    with storage.open(name, "rb") as f:
+        with Image.open(f) as img:
+            img = ImageOps.exif_transpose(img)
+            img.load()
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    return img
+
+
+def generate_variants(name, storage=None, force=False):
+    """Genera las variantes WebP de la imagen `name` y devuelve sus anchos.
+
+    Las que ya existen no se regeneran salvo con `force`. Si el fichero no
+    es una imagen válida devuelve una lista vacía.
+    """
+    storage = storage or default_storage
+    if not _is_local(name):
+        return []
+
+    img = None
+    widths = []
+    for width in VARIANT_WIDTHS:
+        target = variant_name(name, width)
+        if storage.exists(target):
+            if not force:
+                widths.append(width)
+                continue
+            storage.delete(target)
+
+        if img is None:
+            try:
+                img = _open(name, storage)
+            except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+                return []
+        if width > img.width:
+            break
+
+        variant = img.copy()
+        variant.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+        buf = BytesIO()
+        variant.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+        storage.save(target, ContentFile(buf.getvalue()))
+        widths.append(width)
+    return widths
+
+
+def existing_variants(name, storage=None):
+    """[(ancho, nombre)] de las variantes ya generadas para `name`."""
+    storage = storage or default_storage
+    if not _is_local(name):
+        return []
+    return [
+        (width, variant_name(name, width))
+        for width in VARIANT_WIDTHS
+        if storage.exists(variant_name(name, width))
+    ]
+
+
+def delete_variants(name, storage=None):
+    storage = storage or default_storage
+    if not _is_local(name):
+        return
+    for width in VARIANT_WIDTHS:
+        target = variant_name(name, width)
+        if storage.exists(target):
+            storage.delete(target)
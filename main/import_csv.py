@@ -1,8 +1,20 @@
 import csv
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+from itertools import chain, islice
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from main import images
+from main.products import search
 from main.products.models import Product
 
 #python manage.py shell -c "from main.import_csv import cargar; print(cargar())"
@@ -10,11 +22,103 @@ from main.products.models import Product
 # Ruta del CSV donde lo guardaste
 CSV_PATH = os.path.join(settings.BASE_DIR, "main", "productos.csv")
 
+# Caché en disco de las imágenes descargadas (clave: hash de la URL)
+IMAGE_CACHE_DIR = getattr(settings, "IMPORT_IMAGE_CACHE_DIR", os.path.join(settings.BASE_DIR, ".cache", "product_images"))
+
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 0.5
+
+
+def _crear_sesion(workers, retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    """Sesión HTTP con pool de conexiones y reintentos con backoff exponencial."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _ruta_en_cache(url, cache_dir):
+    return os.path.join(cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+
+def _descargar(session, url, cache_dir):
+    path = _ruta_en_cache(url, cache_dir)
+    if os.path.exists(path):
+        return path
+
+    resp = session.get(url, timeout=DOWNLOAD_TIMEOUT)
+    if resp.status_code != 200:
+        print(f"Error descargando imagen {url}: HTTP {resp.status_code}")
+        return None
+
+    # Escribir en un temporal y renombrar para no dejar ficheros a medias si se interrumpe
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(resp.content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def descargar_imagenes(urls, workers=DOWNLOAD_WORKERS, cache_dir=None, retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    """Descarga en paralelo las imágenes de `urls` y devuelve {url: ruta en caché}.
+
+    Las imágenes ya presentes en la caché no se vuelven a pedir, así que una
+    importación interrumpida se reanuda donde se quedó. Las URLs que fallan
+    tras los reintentos no aparecen en el resultado.
+    """
+    cache_dir = cache_dir or IMAGE_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    pending = sorted({u for u in urls if u and u.startswith("http")})
+    paths = {}
+    with _crear_sesion(workers, retries, backoff) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_descargar, session, url, cache_dir): url for url in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                print(f"Error descargando imagen {url}: {e}")
+                continue
+            if path:
+                paths[url] = path
+    return paths
+
+
+def _asignar_imagen(product, foto_url, imagenes):
+    path = imagenes.get(foto_url)
+    if not path:
+        return
+    with open(path, "rb") as f:
+        contenido = f.read()
+
+    # Nombre con hash del contenido (nombre.<12 hex>.ext): se sirve con caché
+    # de larga duración y las imágenes repetidas comparten fichero
+    base, ext = os.path.splitext(foto_url.split("/")[-1].split("?")[0].split(":")[0])
+    filename = f"{base}.{hashlib.sha256(contenido).hexdigest()[:12]}{ext}"
+    field = product.image
+    name = field.field.generate_filename(product, filename)
+    if field.storage.exists(name):
+        field.name = name
+    else:
+        field.save(filename, ContentFile(contenido), save=False)
+    images.generate_variants(field.name, field.storage)
+
 
 def importar_productos_desde_csv():
 
     print("Borrando tabla de productos...")
-    Product.objects.all().delete()
+    Product.all_objects.all().delete()
 
     print(f"Leyendo CSV desde: {CSV_PATH}")
 
@@ -22,43 +126,41 @@ def importar_productos_desde_csv():
         print("ERROR: No se encuentra el archivo productos.csv")
         return
 
-    with open(CSV_PATH, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-
-        total = 0
-        for row in reader:
-            total += 1
-
-            name = row["titulo"]
-            ref = row["link"]
-            foto_url = row["foto"]
-            disponible = row["disponible"].lower() == "true"
-            descripcion = row["descripcion"]
-            sabor = row["sabor"]
-            precio = float(row["precio"])
-
-            # Crear producto (sin imagen todavía)
-            p = Product(
-                name=name,
-                ref=ref,
-                price=precio,
-                flavor=sabor,
-                size=descripcion,
-            )
-
-            # Descargar imagen del producto si existe
-            try:
-                if foto_url.startswith("http"):
-                    img_resp = requests.get(foto_url, timeout=10)
-                    if img_resp.status_code == 200:
-                        filename = foto_url.split("/")[-1]
-                        p.image.save(filename, ContentFile(img_resp.content), save=False)
-            except Exception as e:
-                print(f"Error descargando imagen {foto_url}: {e}")
+    resultado = importar_por_lotes(leer_filas(CSV_PATH))
+    total = resultado["creados"]
 
-            p.save()
+    print(f"Importación finalizada. Productos añadidos: {total}")
 
-        print(f"Importación finalizada. Productos añadidos: {total}")
+
+PRODUCTOS_PERSONALIZADOS = [
+    {
+        "titulo": "CR7 Drive de Herbalife24®",
+        "link": "https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-540g-1466",
+        "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1466-es-pt.png:tile-w405h566?fmt=webp-alpha",
+        "disponible": "True",
+        "descripcion": "540 g",
+        "sabor": "Frutos Acai",
+        "precio": "24.86"
+    },
+    {
+        "titulo": "Botella Deportiva CR7 Drive",
+        "link": "https://natursur.herbalife.com/es-es/u/products/botella-deportiva-cr7-drive-245a",
+        "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-245a-emea.png:tile-w405h566?fmt=webp-alpha",
+        "disponible": "True",
+        "descripcion": "",
+        "sabor": "",
+        "precio": "7.70"
+    },
+    {
+        "titulo": "CR7 Drive de Herbalife24®",
+        "link": "https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-10-x-27g-1467",
+        "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1467-es-pt.png:tile-w405h566?fmt=webp-alpha",
+        "disponible": "True",
+        "descripcion": "10 x 27 g",
+        "sabor": "Frutos Acai",
+        "precio": "15.00"
+    }
+]
 
 
 def añadir_personalizados():
@@ -66,40 +168,12 @@ def añadir_personalizados():
     # CR7 Drive de Herbalife24®,https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-540g-1466,https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1466-es-pt.png:tile-w405h566?fmt=webp-alpha,True,540 g,Frutos Acai,24.86
     # Botella Deportiva CR7 Drive,https://natursur.herbalife.com/es-es/u/products/botella-deportiva-cr7-drive-245a,https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-245a-emea.png:tile-w405h566?fmt=webp-alpha,True,,,7.70
     # CR7 Drive de Herbalife24®,https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-10-x-27g-1467,https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1467-es-pt.png:tile-w405h566?fmt=webp-alpha,True,10 x 27 g,Frutos Acai,15.00
-    productos_personalizados = [
-        {
-            "titulo": "CR7 Drive de Herbalife24®",
-            "link": "https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-540g-1466",
-            "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1466-es-pt.png:tile-w405h566?fmt=webp-alpha",
-            "disponible": "True",
-            "descripcion": "540 g",
-            "sabor": "Frutos Acai",
-            "precio": "24.86"
-        },
-        {
-            "titulo": "Botella Deportiva CR7 Drive",
-            "link": "https://natursur.herbalife.com/es-es/u/products/botella-deportiva-cr7-drive-245a",
-            "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-245a-emea.png:tile-w405h566?fmt=webp-alpha",
-            "disponible": "True",
-            "descripcion": "",
-            "sabor": "",
-            "precio": "7.70"
-        },
-        {
-            "titulo": "CR7 Drive de Herbalife24®",
-            "link": "https://natursur.herbalife.com/es-es/u/products/cr7-drive-herbalife24-frutos-acai-10-x-27g-1467",
-            "foto": "https://natursur.herbalife.com/dmassets/regional-reusable-assets/emea/images/product-canister/pc-1467-es-pt.png:tile-w405h566?fmt=webp-alpha",
-            "disponible": "True",
-            "descripcion": "10 x 27 g",
-            "sabor": "Frutos Acai",
-            "precio": "15.00"
-        }
-    ]
-
     print("Añadiendo productos personalizados...")
 
 
-    for prod in productos_personalizados:
+    imagenes = descargar_imagenes(prod["foto"] for prod in PRODUCTOS_PERSONALIZADOS)
+
+    for prod in PRODUCTOS_PERSONALIZADOS:
 
         # 1. Guardar en base de datos
         p = Product(
@@ -110,21 +184,208 @@ def añadir_personalizados():
             size=prod["descripcion"]
         )
 
-        # Descargar imagen
-        foto_url = prod["foto"]
-        try:
-            if foto_url.startswith("http"):
-                img_resp = requests.get(foto_url, timeout=10)
-                if img_resp.status_code == 200:
-                    filename = foto_url.split("/")[-1]
-                    p.image.save(filename, ContentFile(img_resp.content), save=False)
-        except Exception as e:
-            print(f"Error descargando imagen {foto_url}: {e}")
+        # Imagen (descargada en paralelo arriba)
+        _asignar_imagen(p, prod["foto"], imagenes)
 
         p.save()
            
     print("Productos personalizados añadidos.")
 
+
+SYNC_FIELDS = ["name", "price", "flavor", "size", "stock", "sync_unavailable"]
+SYNC_BATCH_SIZE = 500
+
+# Stock con el que se dan de alta los productos nuevos (el mismo que el default del modelo)
+STOCK_INICIAL = Product._meta.get_field("stock").default
+
+# Caracteres invisibles que aparecen en los títulos copiados de la web
+_INVISIBLES = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"))
+
+
+class FilaInvalida(ValueError):
+    pass
+
+
+def _limpiar_texto(value):
+    return " ".join((value or "").translate(_INVISIBLES).split())
+
+
+def _normalizar_precio(value):
+    texto = (value or "").replace("€", "").strip().replace(",", ".")
+    try:
+        precio = Decimal(texto).quantize(Decimal("0.01"))
+    except ArithmeticError:
+        raise FilaInvalida(f"precio no válido: {value!r}")
+    if not precio.is_finite():
+        raise FilaInvalida(f"precio no válido: {value!r}")
+    if precio < 0 or precio >= 10 ** 4:
+        raise FilaInvalida(f"precio fuera de rango: {value!r}")
+    return precio
+
+
+def normalizar_fila(row):
+    """Valida una fila del CSV y devuelve sus valores ya normalizados.
+
+    Lanza `FilaInvalida` si falta la referencia o el título, o si el precio
+    no es un número válido.
+    """
+    ref = (row.get("link") or "").strip()
+    name = _limpiar_texto(row.get("titulo"))
+    if not ref or not name:
+        raise FilaInvalida("fila sin referencia o sin título")
+    return {
+        "name": name,
+        "ref": ref,
+        "foto": (row.get("foto") or "").strip(),
+        "disponible": (row.get("disponible") or "").strip().lower() == "true",
+        "size": _limpiar_texto(row.get("descripcion")),
+        "flavor": _limpiar_texto(row.get("sabor")),
+        "price": _normalizar_precio(row.get("precio")),
+    }
+
+
+def leer_filas(path):
+    """Genera las filas del CSV de una en una, sin cargar el fichero entero."""
+    with open(path, newline="", encoding="utf-8") as csvfile:
+        yield from csv.DictReader(csvfile)
+
+
+def en_lotes(iterable, size):
+    iterator = iter(iterable)
+    while lote := list(islice(iterator, size)):
+        yield lote
+
+
+def _escribir_lote(filas, stamp):
+    """Crea o actualiza en una transacción los productos de un lote.
+
+    Devuelve (creados, actualizados, sin cambios). Todos los productos del
+    lote quedan marcados con `synced_at = stamp`.
+    """
+    # Si una referencia se repite dentro del lote se queda la última fila
+    por_ref = {fila["ref"]: fila for fila in filas}
+    # Incluye los archivados para no duplicarlos (siguen archivados)
+    existentes = {p.ref: p for p in Product.all_objects.filter(ref__in=list(por_ref))}
+
+    imagenes = descargar_imagenes(
+        v["foto"] for ref, v in por_ref.items()
+        if ref not in existentes or not existentes[ref].image
+    )
+
+    nuevos, cambiados = [], []
+    sin_cambios = 0
+    for ref, v in por_ref.items():
+        p = existentes.get(ref)
+        if p is None:
+            p = Product(ref=ref, name=v["name"], price=v["price"], flavor=v["flavor"], size=v["size"],
+                        stock=STOCK_INICIAL if v["disponible"] else 0, sync_unavailable=not v["disponible"],
+                        synced_at=stamp)
+            _asignar_imagen(p, v["foto"], imagenes)
+            nuevos.append(p)
+            continue
+
+        changed = False
+        for field in ("name", "price", "flavor", "size"):
+            if getattr(p, field) != v[field]:
+                setattr(p, field, v[field])
+                changed = True
+        if not v["disponible"] and not p.sync_unavailable:
+            p.stock = 0
+            p.sync_unavailable = True
+            changed = True
+        elif v["disponible"] and p.sync_unavailable:
+            # Solo se repone el stock que quitó la sincronización, no el que se ajustó a mano después
+            if not p.stock:
+                p.stock = STOCK_INICIAL
+            p.sync_unavailable = False
+            changed = True
+        if not p.image and v["foto"] in imagenes:
+            _asignar_imagen(p, v["foto"], imagenes)
+            changed = True
+
+        if changed:
+            cambiados.append(p)
+        else:
+            sin_cambios += 1
+
+    with transaction.atomic():
+        Product.objects.bulk_create(nuevos, batch_size=len(por_ref))
+        Product.objects.bulk_update(cambiados, SYNC_FIELDS + ["image"], batch_size=len(por_ref))
+        Product.all_objects.filter(ref__in=list(por_ref)).update(synced_at=stamp)
+
+    return len(nuevos), len(cambiados), sin_cambios
+
+
+def importar_por_lotes(filas, batch_size=SYNC_BATCH_SIZE, stamp=None):
+    """Pipeline de importación en streaming.
+
+    Normaliza las filas según llegan del generador, las agrupa en lotes de
+    `batch_size` y escribe cada lote en su propia transacción, de modo que la
+    memoria depende del tamaño del lote y no del fichero. Las filas no válidas
+    se saltan y se cuentan. Informa del progreso (filas/s) tras cada lote.
+    """
+    stamp = stamp or timezone.now()
+    resultado = {"creados": 0, "actualizados": 0, "sin_cambios": 0, "invalidas": 0}
+
+    def validas():
+        for numero, row in enumerate(filas, start=1):
+            try:
+                yield normalizar_fila(row)
+            except (FilaInvalida, KeyError) as e:
+                resultado["invalidas"] += 1
+                print(f"Fila {numero} descartada: {e}")
+
+    inicio = time.perf_counter()
+    procesadas = 0
+    for lote in en_lotes(validas(), batch_size):
+        creados, actualizados, sin_cambios = _escribir_lote(lote, stamp)
+        resultado["creados"] += creados
+        resultado["actualizados"] += actualizados
+        resultado["sin_cambios"] += sin_cambios
+        procesadas += len(lote)
+        segundos = time.perf_counter() - inicio
+        print(f"{procesadas} filas procesadas ({procesadas / segundos:.0f} filas/s)")
+
+    # bulk_create/bulk_update no disparan señales: reconstruir el índice de búsqueda
+    if resultado["creados"] or resultado["actualizados"]:
+        search.rebuild_index()
+    return resultado
+
+
+def sincronizar_productos_desde_csv(batch_size=SYNC_BATCH_SIZE):
+    """Sincroniza la tabla de productos con el CSV sin borrarla.
+
+    Crea los productos nuevos, actualiza los que han cambiado (por `ref`) y
+    pone a stock 0 los que ya no aparecen en el CSV o vienen como no
+    disponibles, en lugar de borrarlos; los ids y el historial de pedidos se
+    conservan. Estos quedan marcados con `sync_unavailable` y recuperan
+    `STOCK_INICIAL` cuando vuelven a venir como disponibles. Los ausentes se detectan por `synced_at`, sin tener que
+    guardar en memoria las referencias leídas. Devuelve un diccionario con
+    los totales.
+    """
+    print(f"Leyendo CSV desde: {CSV_PATH}")
+
+    if not os.path.exists(CSV_PATH):
+        print("ERROR: No se encuentra el archivo productos.csv")
+        return None
+
+    stamp = timezone.now()
+    filas = chain(leer_filas(CSV_PATH), PRODUCTOS_PERSONALIZADOS)
+    resultado = importar_por_lotes(filas, batch_size=batch_size, stamp=stamp)
+
+    resultado["no_disponibles"] = (
+        Product.objects.exclude(ref__isnull=True).exclude(ref="").exclude(synced_at=stamp)
+        .filter(sync_unavailable=False)
+        .update(stock=0, sync_unavailable=True)
+    )
+    print(
+        f"Sincronización finalizada. Creados: {resultado['creados']}, actualizados: {resultado['actualizados']}, "
+        f"sin cambios: {resultado['sin_cambios']}, marcados sin stock: {resultado['no_disponibles']}, "
+        f"filas descartadas: {resultado['invalidas']}"
+    )
+    return resultado
+
+
 def cargar():
     importar_productos_desde_csv()
     añadir_personalizados()
@@ -0,0 +1,100 @@
+import statistics
+import time
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from main.orders.models import Order, OrderProduct
+from main.products.models import Product
+
+
+BENCH_PREFIX = 'bench-cart-api-'
+
+
+class Command(BaseCommand):
+    help = 'Compare the redirect cart flow (add_to_cart/remove_from_cart) with the async JSON endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=60, help='Number of products to seed (catalog size)')
+        parser.add_argument('--requests', type=int, default=100, help='Adds and removes per flow')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows after the run')
+
+    def handle(self, *args, **options):
+        self._cleanup()
+        Product.objects.bulk_create([
+            Product(name=f"Bench cart {i}", ref=f"{BENCH_PREFIX}{i}", price=Decimal('3.20'), stock=1_000_000)
+            for i in range(options['products'])
+        ])
+        product_ids = list(Product.objects.filter(ref__startswith=BENCH_PREFIX).values_list('id', flat=True))
+        targets = [product_ids[i % len(product_ids)] for i in range(options['requests'])]
+
+        try:
+            # AsyncClient siempre envía Host: testserver
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                redirect_add, redirect_remove = self._redirect_flow(targets)
+                json_add, json_remove = async_to_sync(self._json_flow)(targets)
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+        self.stdout.write(f"{len(targets)} adds and removes per flow, {len(product_ids)} products in the catalog")
+        self._report('add    redirect + render', redirect_add)
+        self._report('add    async JSON       ', json_add)
+        self._report('remove redirect + render', redirect_remove)
+        self._report('remove async JSON       ', json_remove)
+        self.stdout.write(self.style.SUCCESS(
+            f"Speed-up (p50): add x{statistics.median(redirect_add) / statistics.median(json_add):.1f}, "
+            f"remove x{statistics.median(redirect_remove) / statistics.median(json_remove):.1f}"
+        ))
+
+    def _redirect_flow(self, targets):
+        client = Client()
+        client.cookies['anon_user_id'] = f"{BENCH_PREFIX}redirect"
+        adds = []
+        for product_id in targets:
+            start = time.perf_counter()
+            client.post(reverse('add_to_cart', args=[product_id]), {'quantity': 1, 'page': 1}, follow=True)
+            adds.append((time.perf_counter() - start) * 1000)
+
+        removes = []
+        for line_id in self._line_ids(f"{BENCH_PREFIX}redirect", targets):
+            start = time.perf_counter()
+            client.post(reverse('remove_from_cart', args=[line_id]), follow=True)
+            removes.append((time.perf_counter() - start) * 1000)
+        return adds, removes
+
+    async def _json_flow(self, targets):
+        client = AsyncClient()
+        client.cookies['anon_user_id'] = f"{BENCH_PREFIX}json"
+        adds = []
+        line_ids = []
+        for product_id in targets:
+            start = time.perf_counter()
+            resp = await client.post(reverse('add_to_cart_json', args=[product_id]), {'quantity': 1})
+            adds.append((time.perf_counter() - start) * 1000)
+            line_ids.append(resp.json()['line']['line_id'])
+
+        removes = []
+        for line_id in line_ids:
+            start = time.perf_counter()
+            await client.post(reverse('remove_from_cart_json', args=[line_id]))
+            removes.append((time.perf_counter() - start) * 1000)
+        return adds, removes
+
+    def _line_ids(self, cookie, targets):
+        # Un id de línea por unidad añadida: cada borrado resta una y la última borra la línea
+        by_product = dict(OrderProduct.objects.filter(
+            order__status='EN_CARRITO', order__anonymous_user_cookie=cookie,
+        ).values_list('product_id', 'id'))
+        return [by_product[product_id] for product_id in targets]
+
+    def _report(self, label, latencies):
+        p = statistics.quantiles(latencies, n=100) if len(latencies) >= 2 else latencies * 99
+        self.stdout.write(f"  {label}: p50 {p[49]:6.1f} ms, p95 {p[94]:6.1f} ms")
+
+    def _cleanup(self):
+        Order.objects.filter(anonymous_user_cookie__startswith=BENCH_PREFIX).delete()
+        Product.objects.filter(ref__startswith=BENCH_PREFIX).delete()
@@ -0,0 +1,65 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from main.orders.models import Order, OrderProduct
+from main.products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Benchmark time per catalog page (list_products) against a large product fixture'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000, help='Number of products to seed')
+        parser.add_argument('--pages', type=int, default=20, help='Number of catalog pages to request')
+        parser.add_argument('--cart-lines', type=int, default=10, help='Lines in the anonymous cart used for the run')
+
+    def handle(self, *args, **options):
+        n_products = options['products']
+        n_pages = options['pages']
+
+        # Todo se hace dentro de una transacción que se revierte al final para no tocar la BD real
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {n_products} products...")
+            Product.objects.bulk_create(
+                [
+                    Product(name=f"Bench product {i}", ref=f"bench-{i}", price=Decimal('9.99'), stock=i % 50)
+                    for i in range(n_products)
+                ],
+                batch_size=2000,
+            )
+
+            cookie = 'bench-catalog'
+            order = Order.objects.create(status='EN_CARRITO', anonymous_user_cookie=cookie)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=p, quantity=1, price_at_order=p.price)
+                for p in Product.objects.filter(ref__startswith='bench-')[:options['cart_lines']]
+            ])
+
+            client = Client(HTTP_HOST='localhost')
+            client.cookies['anon_user_id'] = cookie
+            url = reverse('list_products')
+            last_page = max(n_products // 21, 1)
+            page_numbers = [1 + (i * last_page) // max(n_pages, 1) for i in range(n_pages)]
+
+            timings = []
+            for page in page_numbers:
+                start = time.perf_counter()
+                resp = client.get(url, {'page': page})
+                timings.append((time.perf_counter() - start) * 1000)
+                if resp.status_code != 200:
+                    self.stdout.write(self.style.ERROR(f"Page {page} returned {resp.status_code}"))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} pages over {n_products} products: "
+            f"mean {statistics.mean(timings):.1f} ms, "
+            f"median {statistics.median(timings):.1f} ms, "
+            f"max {max(timings):.1f} ms"
+        ))
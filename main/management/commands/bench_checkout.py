@@ -0,0 +1,119 @@
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from main.orders.models import Order, OrderProduct
+from main.products.models import Product
+
+
+BENCH_PREFIX = 'bench-checkout-'
+
+
+class Command(BaseCommand):
+    help = 'Drive parallel finalize_order checkouts and report latency, throughput, oversell and lock errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20, help='Number of products to seed')
+        parser.add_argument('--stock', type=int, default=50, help='Initial stock of each product')
+        parser.add_argument('--carts', type=int, default=200, help='Number of anonymous carts to finalize')
+        parser.add_argument('--lines', type=int, default=3, help='Lines per cart')
+        parser.add_argument('--max-quantity', type=int, default=3, help='Max quantity per line')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent finalizations')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the cart contents')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows after the run')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self._cleanup()
+
+        Product.objects.bulk_create([
+            Product(name=f"Bench checkout {i}", ref=f"{BENCH_PREFIX}{i}", price=Decimal('4.50'), stock=options['stock'])
+            for i in range(options['products'])
+        ])
+        products = list(Product.objects.filter(ref__startswith=BENCH_PREFIX))
+
+        cookies = []
+        for i in range(options['carts']):
+            cookie = f"{BENCH_PREFIX}{i}"
+            order = Order.objects.create(status='EN_CARRITO', anonymous_user_cookie=cookie)
+            picked = rng.sample(products, min(options['lines'], len(products)))
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=p, quantity=rng.randint(1, options['max_quantity']), price_at_order=p.price)
+                for p in picked
+            ])
+            order.refresh_totals()
+            cookies.append(cookie)
+
+        self.stdout.write(
+            f"Seeded {len(products)} products (stock {options['stock']}) and {len(cookies)} carts; "
+            f"running with {options['workers']} workers..."
+        )
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(self._checkout, cookies))
+        elapsed = time.perf_counter() - start
+
+        latencies = [r['ms'] for r in results]
+        paid = sum(1 for r in results if r['outcome'] == 'paid')
+        rejected = sum(1 for r in results if r['outcome'] == 'rejected')
+        locked = sum(1 for r in results if r['outcome'] == 'locked')
+        errors = sum(1 for r in results if r['outcome'] == 'error')
+
+        sold = dict(
+            OrderProduct.objects.filter(product__ref__startswith=BENCH_PREFIX, order__is_paid=True)
+            .values_list('product_id')
+            .annotate(total=Sum('quantity'))
+        )
+        oversold = sum(max(qty - options['stock'], 0) for qty in sold.values())
+
+        if len(latencies) >= 2:
+            p = statistics.quantiles(latencies, n=100)
+            p50, p95, p99 = p[49], p[94], p[98]
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else 0.0
+
+        self.stdout.write(f"Checkouts: {len(results)} in {elapsed:.2f} s ({len(results) / elapsed:.1f} req/s)")
+        self.stdout.write(f"Latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+        self.stdout.write(f"Paid: {paid}, rejected for stock: {rejected}, 'database is locked': {locked}, other errors: {errors}")
+        style = self.style.ERROR if oversold else self.style.SUCCESS
+        self.stdout.write(style(f"Oversold units: {oversold}"))
+
+        if not options['keep']:
+            self._cleanup()
+
+    def _checkout(self, cookie):
+        client = Client(HTTP_HOST='localhost')
+        client.cookies['anon_user_id'] = cookie
+        outcome = 'error'
+        start = time.perf_counter()
+        try:
+            resp = client.post(reverse('finalize_order'), {
+                'solicitant_name': 'Bench User',
+                'solicitant_contact': 'bench@example.com',
+            })
+            if resp.status_code == 200:
+                outcome = 'paid'
+            elif resp.status_code == 302:
+                outcome = 'rejected'
+        except OperationalError as e:
+            if 'locked' in str(e):
+                outcome = 'locked'
+        except Exception:
+            pass
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            connection.close()
+        return {'outcome': outcome, 'ms': ms}
+
+    def _cleanup(self):
+        Order.objects.filter(anonymous_user_cookie__startswith=BENCH_PREFIX).delete()
+        Product.objects.filter(ref__startswith=BENCH_PREFIX).delete()
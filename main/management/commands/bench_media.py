@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.views.static import serve
+
+from main.media import serve_media
+
+
+class Command(BaseCommand):
+    help = "Compare django.views.static.serve with serve_media on a catalog page's worth of images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=21, help='Images per catalog page')
+        parser.add_argument('--size', type=int, default=60, help='Size of each image in KB')
+        parser.add_argument('--rounds', type=int, default=30, help='Times the whole page is requested')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            names = []
+            for i in range(options['images']):
+                name = f"products/bench-{i}.{i:012x}.png"
+                os.makedirs(os.path.join(media_root, 'products'), exist_ok=True)
+                with open(os.path.join(media_root, name), 'wb') as f:
+                    f.write(os.urandom(options['size'] * 1024))
+                names.append(name)
+
+            with override_settings(MEDIA_ROOT=media_root):
+                self._run(names, media_root, options['rounds'])
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def _run(self, names, media_root, rounds):
+        # Misma pila de middleware para las dos vistas: se cambia solo la vista
+        client = Client(HTTP_HOST='localhost')
+        with override_settings(ROOT_URLCONF=_legacy_urlconf(media_root)):
+            legacy = self._rate(client, names, rounds)
+            legacy_cache = client.get(f'/media/{names[0]}').get('Cache-Control', '-')
+        current = self._rate(client, names, rounds)
+
+        first = client.get(f'/media/{names[0]}')
+        etags = {name: client.get(f'/media/{name}')['ETag'] for name in names}
+        revalidated = self._rate(client, names, rounds, etags)
+
+        self.stdout.write(f"{len(names)} images x {rounds} rounds")
+        self.stdout.write(f"  django.views.static.serve: {legacy[0]:8.0f} req/s, {legacy[1] / 1024:8.0f} KB/page, Cache-Control: {legacy_cache}")
+        self.stdout.write(f"  serve_media (200):         {current[0]:8.0f} req/s, {current[1] / 1024:8.0f} KB/page, Cache-Control: {first['Cache-Control']}")
+        self.stdout.write(f"  serve_media (304):         {revalidated[0]:8.0f} req/s, {revalidated[1] / 1024:8.0f} KB/page")
+
+    def _rate(self, client, names, rounds, etags=None):
+        """Devuelve (peticiones/s, bytes de cuerpo por página)."""
+        sent = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for name in names:
+                headers = {'If-None-Match': etags[name]} if etags else None
+                resp = client.get(f'/media/{name}', headers=headers)
+                if resp.streaming:
+                    for chunk in resp.streaming_content:
+                        sent += len(chunk)
+                else:
+                    sent += len(resp.content)
+                resp.close()
+        return rounds * len(names) / (time.perf_counter() - start), sent / rounds
+
+
+def _legacy_urlconf(media_root):
+    from django.urls import path
+
+    class LegacyUrls:
+        urlpatterns = [path('media/<path:path>', serve, {'document_root': media_root})]
+    return LegacyUrls
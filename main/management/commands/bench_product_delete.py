@@ -0,0 +1,67 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.signals import pre_delete
+
+from main.orders.models import Order, OrderProduct, handle_product_pre_delete
+from main.products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Time deleting a product referenced by many historical order lines (set-based snapshot vs per-line save)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10000, help='Historical order lines referencing the product')
+
+    def handle(self, *args, **options):
+        for label, legacy in (('per-line save()', True), ('set-based UPDATE', False)):
+            with transaction.atomic():
+                product = self._seed(options['lines'])
+                elapsed, queries = self._delete(product, legacy)
+                transaction.set_rollback(True)
+            self.stdout.write(f"{label:>17}: {elapsed * 1000:9.1f} ms, {queries} queries")
+
+    def _seed(self, n):
+        product = Product.objects.create(name='Bench delete', price=Decimal('4.50'), stock=0)
+        orders = Order.objects.bulk_create(
+            [Order(status='SOLICITADO', anonymous_user_cookie=f'bench-delete-{i}') for i in range(n)],
+            batch_size=2000,
+        )
+        OrderProduct.objects.bulk_create(
+            [OrderProduct(order=o, product=product, quantity=1) for o in orders],
+            batch_size=2000,
+        )
+        return product
+
+    def _delete(self, product, legacy):
+        if legacy:
+            pre_delete.disconnect(handle_product_pre_delete, sender=Product)
+        try:
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            start = time.perf_counter()
+            with connection.execute_wrapper(count):
+                if legacy:
+                    _legacy_snapshot(product)
+                product.delete()
+            return time.perf_counter() - start, len(queries)
+        finally:
+            if legacy:
+                pre_delete.connect(handle_product_pre_delete, sender=Product)
+
+
+def _legacy_snapshot(product):
+    # Lo que hacían antes delete_product_admin y el pre_delete: un save() por línea
+    for line in OrderProduct.objects.filter(product=product).exclude(order__status='EN_CARRITO'):
+        if not line.product_name:
+            line.product_name = product.name
+        if not line.price_at_order:
+            line.price_at_order = product.price
+        line.save()
+    OrderProduct.objects.filter(product=product).update(product=None)
@@ -0,0 +1,72 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.products import search
+from main.products.models import Product
+
+
+WORDS = [
+    'Batido', 'Fórmula', 'Proteína', 'Bebida', 'Instantánea', 'Té', 'Aloe', 'Barritas', 'Crema',
+    'Hidratante', 'Multivitamínico', 'Colágeno', 'Fibra', 'Energía', 'Deportiva', 'Nutritiva',
+]
+FLAVORS = ['Vainilla', 'Chocolate', 'Fresa', 'Limón', 'Melocotón', 'Frutos Rojos', 'Café', 'Mango']
+QUERIES = ['formula', 'vainilla', 'te limon', 'barr', 'proteina choc', 'colageno', 'aloe mango', 'zzz']
+
+
+class Command(BaseCommand):
+    help = 'Compare FTS5 product search against the name__icontains scan on a large catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000, help='Number of products to seed')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            raise CommandError('The FTS5 search index is not available on this database')
+
+        rng = random.Random(0)
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            Product.objects.bulk_create(
+                [
+                    Product(
+                        name=' '.join(rng.sample(WORDS, 3)),
+                        flavor=rng.choice(FLAVORS),
+                        size=f"{rng.randint(1, 20) * 50} g",
+                        ref=f"bench-search-{i}",
+                        price=Decimal('9.99'),
+                    )
+                    for i in range(options['products'])
+                ],
+                batch_size=2000,
+            )
+            search.rebuild_index()
+
+            base = Product.objects.all()
+            for q in QUERIES:
+                # Como el paginador del catálogo: total de resultados + primera página
+                icontains_ms = self._time(lambda: self._page(base.filter(name__icontains=q).order_by('id')), options['repeat'])
+                fts_ms = self._time(lambda: self._page(search.search_products(base, q)), options['repeat'])
+                self.stdout.write(
+                    f"{q!r:>18}: icontains {icontains_ms:7.2f} ms | fts5 {fts_ms:7.2f} ms "
+                    f"({search.search_products(base, q).count()} matches)"
+                )
+
+            transaction.set_rollback(True)
+
+    def _page(self, qs):
+        qs.count()
+        return list(qs[:21])
+
+    def _time(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
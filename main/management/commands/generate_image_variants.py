@@ -0,0 +1,58 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from main import images
+from main.products import catalog_cache
+from main.products.models import Product
+from main.user.models import UserProfile
+
+
+def _generate(name, force):
+    try:
+        return name, images.generate_variants(name, force=force), None
+    except Exception as e:
+        return name, [], str(e)
+
+
+class Command(BaseCommand):
+    help = 'Backfill the WebP thumbnails of existing product images and profile photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (1 runs inline)')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist')
+
+    def handle(self, *args, **options):
+        names = set(
+            Product.all_objects.exclude(image='').exclude(image__isnull=True).exclude(image__startswith='http')
+            .values_list('image', flat=True)
+        )
+        names |= set(
+            UserProfile.objects.exclude(photo='').exclude(photo__isnull=True).values_list('photo', flat=True)
+        )
+        names = sorted(names)
+        self.stdout.write(f"Images to process: {len(names)} with {options['workers']} workers")
+
+        start = time.perf_counter()
+        if options['workers'] > 1:
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+                results = list(pool.map(_generate, names, [options['force']] * len(names), chunksize=8))
+        else:
+            results = [_generate(name, options['force']) for name in names]
+        elapsed = time.perf_counter() - start
+
+        with_variants = 0
+        for name, widths, error in results:
+            if error:
+                self.stdout.write(self.style.WARNING(f"{name}: {error}"))
+            elif widths:
+                with_variants += 1
+
+        # Las tarjetas del catálogo cacheadas no tienen todavía el srcset
+        catalog_cache.bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Images with variants: {with_variants}/{len(names)} in {elapsed:.1f} s"
+        ))
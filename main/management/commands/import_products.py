@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.import_csv import cargar, sincronizar_productos_desde_csv
+
+
+class Command(BaseCommand):
+    help = 'Import products from main/productos.csv (full reload or incremental sync by ref)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync', action='store_true', help='Upsert by ref instead of deleting and recreating every product')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per chunk; each chunk is written in its own transaction (sync mode)')
+
+    def handle(self, *args, **options):
+        if not options['sync']:
+            cargar()
+            return
+
+        result = sincronizar_productos_desde_csv(batch_size=options['batch_size'])
+        if result is None:
+            raise CommandError('No se encuentra el archivo productos.csv')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created: {result['creados']}, updated: {result['actualizados']}, "
+            f"unchanged: {result['sin_cambios']}, marked unavailable: {result['no_disponibles']}, "
+            f"invalid rows: {result['invalidas']}"
+        ))
@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from main.orders.reaper import cart_ttl, reap_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous carts (EN_CARRITO) untouched for longer than ANONYMOUS_CART_TTL_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None, help='Override the age threshold in days (default: ANONYMOUS_CART_TTL_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the carts that would be deleted')
+
+    def handle(self, *args, **options):
+        older_than = datetime.timedelta(days=options['days']) if options['days'] is not None else cart_ttl()
+        reclaimed = reap_carts(older_than=older_than, batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {reclaimed['carts']} anonymous carts and {reclaimed['lines']} cart lines "
+            f"untouched for more than {older_than.days} days"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from main.orders.models import Order, order_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute and verify the denormalized item_count/total_amount counters on Order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report mismatching orders, do not fix them')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders updated per UPDATE statement')
+        parser.add_argument('--carts-only', action='store_true', help='Restrict to orders in EN_CARRITO status')
+
+    def handle(self, *args, **options):
+        qs = Order.objects.all()
+        if options['carts_only']:
+            qs = qs.filter(status='EN_CARRITO')
+
+        totals = order_totals()
+        mismatched = qs.annotate(
+            expected_item_count=totals['item_count'],
+            expected_total_amount=totals['total_amount'],
+        ).filter(
+            ~Q(item_count=F('expected_item_count')) | ~Q(total_amount=F('expected_total_amount'))
+        )
+        mismatched_ids = list(mismatched.values_list('id', flat=True))
+
+        self.stdout.write(f"Orders checked: {qs.count()}, mismatched: {len(mismatched_ids)}")
+        if options['check']:
+            for order_id in mismatched_ids[:50]:
+                self.stdout.write(self.style.WARNING(f"Order {order_id} has stale counters"))
+            return
+
+        updated = 0
+        for start in range(0, len(mismatched_ids), options['batch_size']):
+            batch = mismatched_ids[start:start + options['batch_size']]
+            updated += Order.objects.filter(id__in=batch).update(**order_totals())
+        self.stdout.write(self.style.SUCCESS(f"Counters recomputed for {updated} orders"))
@@ -318,11 +318,10 @@ class Command(BaseCommand):
         
         for op in DEFAULT_ORDER_PRODUCTS:
             obj, created = OrderProduct.objects.update_or_create(
-                id=op.get('id'),
+                order_id=op['order_id'],
+                product_id=op['product_id'],
                 defaults={
-                    'product_id': op['product_id'],
                     'quantity': op['quantity'],
-                    'order_id': op['order_id'],
                     'price_at_order': op['price_at_order'],
                 }
             )
@@ -0,0 +1,151 @@
+"""Servidor de ficheros de `MEDIA_ROOT` con cabeceras de caché.
+
+Sustituye a `django.views.static.serve`:
+
+- ETag y Last-Modified a partir del `stat` del fichero, con respuesta 304
+  a las peticiones condicionales (If-None-Match / If-Modified-Since).
+- Rangos de bytes (`Range: bytes=a-b`, un solo rango) con 206/416.
+- `Cache-Control` de un año e `immutable` para los nombres con hash de
+  contenido (`batido.3f2a9c1b7d4e.png`); el resto se cachea
+  `MEDIA_CACHE_MAX_AGE` segundos y luego se revalida.
+- El fichero se entrega con `FileResponse`, así el servidor WSGI puede usar
+  `wsgi.file_wrapper`/`sendfile` sin copiarlo a memoria.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_CACHE_MAX_AGE = getattr(settings, "MEDIA_CACHE_MAX_AGE", 24 * 60 * 60)
+
+# Mismo formato que ManifestStaticFilesStorage: nombre.<12 hex>.ext
+HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{12}\.[A-Za-z0-9]+$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_hashed_name(path):
+    return bool(HASHED_NAME_RE.search(path))
+
+
+def cache_control(path):
+    if is_hashed_name(path):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={MEDIA_CACHE_MAX_AGE}"
+
+
+def parse_range(header, size):
+    """Devuelve (inicio, fin) inclusivos de un rango único, o None si no aplica.
+
+    Lanza ValueError si el rango es sintácticamente válido pero no se puede
+    satisfacer (416).
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Sufijo: los últimos N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+class _RangeFile:
+    """Lectura limitada a un tramo del fichero para las respuestas 206."""
+
+    def __init__(self, f, start, end):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Fichero no encontrado")
+    try:
+        st = os.stat(fullpath)
+    except OSError:
+        raise Http404("Fichero no encontrado")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("Fichero no encontrado")
+
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = int(st.st_mtime)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": cache_control(path),
+        "Accept-Ranges": "bytes",
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        for name, value in headers.items():
+            not_modified.headers.setdefault(name, value)
+        return not_modified
+
+    content_type = mimetypes.guess_type(fullpath)[0] or "application/octet-stream"
+
+    byte_range = None
+    if _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), st.st_size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response["Content-Range"] = f"bytes */{st.st_size}"
+            return response
+
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response["Content-Length"] = st.st_size
+        return response
+
+    f = open(fullpath, "rb")
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type, headers=headers)
+    else:
+        start, end = byte_range
+        response = FileResponse(_RangeFile(f, start, end), status=206, content_type=content_type, headers=headers)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+    return response
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
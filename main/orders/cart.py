@@ -0,0 +1,56 @@
+from django.utils.functional import cached_property
+
+from main.orders.models import Order, OrderProduct
+
+
+class RequestCart:
+    """Carrito activo (`EN_CARRITO`) de una petición, resuelto una sola vez.
+
+    Se guarda en `request.cart` para que el context processor `cart_status`
+    y las vistas (`list_products`, `view_cart`, `finalize_order`) compartan
+    el mismo pedido y sus líneas en lugar de volver a consultarlos.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @classmethod
+    def for_request(cls, request):
+        cart = getattr(request, 'cart', None)
+        if not isinstance(cart, cls):
+            cart = cls(request)
+            request.cart = cart
+        return cart
+
+    def _queryset(self):
+        request = self.request
+        if hasattr(request, 'user') and request.user.is_authenticated:
+            return Order.objects.filter(status='EN_CARRITO', registered_user=request.user)
+        cookie = request.COOKIES.get('anon_user_id')
+        if cookie:
+            return Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie)
+        return None
+
+    @cached_property
+    def order(self):
+        qs = self._queryset()
+        if qs is None:
+            return None
+        return qs.first()
+
+    @cached_property
+    def lines(self):
+        if not self.order:
+            return []
+        return list(OrderProduct.objects.filter(order=self.order).select_related('product'))
+
+    @property
+    def item_count(self):
+        if not self.order:
+            return 0
+        return int(self.order.item_count or 0)
+
+    def invalidate(self):
+        """Descarta lo cacheado tras modificar el carrito dentro de la misma petición."""
+        self.__dict__.pop('order', None)
+        self.__dict__.pop('lines', None)
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:15
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderProduct = apps.get_model('orders', 'OrderProduct')
+
+    lines = OrderProduct.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    item_count = lines.annotate(total=Sum('quantity')).values('total')
+    total_amount = lines.annotate(
+        total=Round(Sum(F('quantity') * Coalesce('price_at_order', 'product__price'), output_field=models.DecimalField()), 2)
+    ).values('total')
+    Order.objects.update(
+        item_count=Coalesce(Subquery(item_count), 0),
+        total_amount=Coalesce(Subquery(total_amount), Value(Decimal('0.00')), output_field=models.DecimalField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Item count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Total amount'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Funde las líneas repetidas (mismo pedido y producto) antes de crear `unique_order_product`.
+
+    Se conserva la más antigua con la suma de las cantidades y se recalcula
+    el total de los pedidos afectados.
+    """
+    Order = apps.get_model('orders', 'Order')
+    OrderProduct = apps.get_model('orders', 'OrderProduct')
+    duplicated = (
+        OrderProduct.objects.exclude(product__isnull=True)
+        .values('order_id', 'product_id').annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1)
+    )
+    order_ids = set()
+    for group in list(duplicated):
+        lines = OrderProduct.objects.filter(order_id=group['order_id'], product_id=group['product_id'])
+        keep = lines.get(pk=group['keep'])
+        keep.quantity = sum(line.quantity for line in lines)
+        keep.save(update_fields=['quantity'])
+        lines.exclude(pk=keep.pk).delete()
+        order_ids.add(group['order_id'])
+    for order in Order.objects.filter(pk__in=order_ids):
+        lines = OrderProduct.objects.filter(order=order)
+        order.item_count = sum(line.quantity for line in lines)
+        order.total_amount = sum((line.price_at_order or 0) * line.quantity for line in lines)
+        order.save(update_fields=['item_count', 'total_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_item_count_total_amount'),
+        ('products', '0002_remove_orderproduct_order_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_identified',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='Order Identifier'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'registered_user'], name='order_status_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'anonymous_user_cookie'], name='order_status_cookie_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date'], name='order_status_date_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderproduct',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Funde los carritos activos duplicados en el más antiguo antes de crear las restricciones."""
+    Order = apps.get_model('orders', 'Order')
+    OrderProduct = apps.get_model('orders', 'OrderProduct')
+    carts = Order.objects.filter(status='EN_CARRITO')
+    for field in ('registered_user', 'anonymous_user_cookie'):
+        duplicated = (
+            carts.exclude(**{f'{field}__isnull': True})
+            .values(field).annotate(n=Count('id')).filter(n__gt=1)
+            .values_list(field, flat=True)
+        )
+        for value in list(duplicated):
+            keep, *others = carts.filter(**{field: value}).order_by('id')
+            kept_lines = {line.product_id: line for line in OrderProduct.objects.filter(order=keep)}
+            for line in OrderProduct.objects.filter(order__in=others):
+                existing = kept_lines.get(line.product_id) if line.product_id else None
+                if existing:
+                    existing.quantity += line.quantity
+                    existing.save(update_fields=['quantity'])
+                    line.delete()
+                else:
+                    line.order = keep
+                    line.save(update_fields=['order'])
+                    kept_lines[line.product_id] = line
+            Order.objects.filter(pk__in=[o.pk for o in others]).delete()
+            lines = OrderProduct.objects.filter(order=keep)
+            keep.item_count = sum(line.quantity for line in lines)
+            keep.total_amount = sum((line.price_at_order or 0) * line.quantity for line in lines)
+            keep.save(update_fields=['item_count', 'total_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('registered_user__isnull', False), ('status', 'EN_CARRITO')), fields=('registered_user',), name='unique_active_cart_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('anonymous_user_cookie__isnull', False), ('status', 'EN_CARRITO')), fields=('anonymous_user_cookie',), name='unique_active_cart_cookie'),
+        ),
+    ]
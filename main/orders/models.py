@@ -1,8 +1,12 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least, NullIf, Round
 from django.contrib.auth.models import User
-from django.db import transaction, IntegrityError
+from django.contrib.auth.signals import user_logged_in
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from main.products.models import Product
@@ -22,7 +26,7 @@ class Order(models.Model):
     solicitant_name = models.CharField(max_length=255, blank=True,null=True, default="", verbose_name="Solicitant Full Name (String)")
     solicitant_contact = models.CharField(max_length=255, blank=True,null=True, default="", verbose_name="Solicitant Contact (Email/Phone)")
     solicitant_address = models.CharField(max_length=255, blank=True, null=True, verbose_name="Solicitant Address (optional)")
-    order_identified = models.CharField(max_length=100, blank=True, null=True, verbose_name="Order Identifier")
+    order_identified = models.CharField(max_length=100, blank=True, null=True, unique=True, verbose_name="Order Identifier")
     
     anonymous_user_cookie = models.CharField(max_length=255, blank=True, null=True, verbose_name="Anonymous User Cookie")
 
@@ -35,16 +39,77 @@ class Order(models.Model):
     )
 
     date = models.DateTimeField(auto_now_add=True, verbose_name="Date")
+    # Última modificación; los UPDATE por queryset (`refresh_totals`) lo fijan a mano
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated at")
     is_paid = models.BooleanField(default=False, verbose_name="Is Paid (estaPagado)")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='SOLICITADO', verbose_name="Status (estado)")
 
+    # Contadores desnormalizados de las líneas; se recalculan con `refresh_totals`
+    item_count = models.PositiveIntegerField(default=0, verbose_name="Item count")
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Total amount")
+
     class Meta:
         verbose_name = "Solicited Product"
         verbose_name_plural = "Solicited Products"
+        indexes = [
+            models.Index(fields=['status', 'registered_user'], name='order_status_user_idx'),
+            models.Index(fields=['status', 'anonymous_user_cookie'], name='order_status_cookie_idx'),
+            models.Index(fields=['status', 'date'], name='order_status_date_idx'),
+            models.Index(fields=['status', 'updated_at'], name='order_status_updated_idx'),
+        ]
+        constraints = [
+            # Un único carrito activo por usuario y por cookie anónima
+            models.UniqueConstraint(
+                fields=['registered_user'],
+                condition=Q(status='EN_CARRITO', registered_user__isnull=False),
+                name='unique_active_cart_user',
+            ),
+            models.UniqueConstraint(
+                fields=['anonymous_user_cookie'],
+                condition=Q(status='EN_CARRITO', anonymous_user_cookie__isnull=False),
+                name='unique_active_cart_cookie',
+            ),
+        ]
 
     def _str_(self):
         return f"Order {self.id} - {self.get_status_display()}"
 
+    def refresh_totals(self):
+        """Recalcula `item_count` y `total_amount` en un único UPDATE.
+
+        También marca `updated_at`: todas las modificaciones del carrito pasan
+        por aquí, y es lo que usa `reap_carts` para detectar los abandonados.
+        """
+        Order.objects.filter(pk=self.pk).update(**order_totals(), updated_at=timezone.now())
+        self.refresh_from_db(fields=['item_count', 'total_amount', 'updated_at'])
+
+    async def arefresh_totals(self):
+        await Order.objects.filter(pk=self.pk).aupdate(**order_totals(), updated_at=timezone.now())
+        await self.arefresh_from_db(fields=['item_count', 'total_amount', 'updated_at'])
+
+
+def order_totals():
+    """Expresiones (subconsultas sobre `OrderProduct`) con los totales de cada pedido.
+
+    Se usan tanto para actualizar los contadores (`.update(**order_totals())`)
+    como para verificarlos (`.annotate(...)`).
+    """
+    lines = OrderProduct.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    item_count = lines.annotate(total=Sum('quantity')).values('total')
+    total_amount = lines.annotate(
+        total=Round(Sum(F('quantity') * Coalesce('price_at_order', 'product__price'), output_field=models.DecimalField()), 2)
+    ).values('total')
+    return {
+        'item_count': Coalesce(Subquery(item_count), 0),
+        'total_amount': Coalesce(Subquery(total_amount), Value(Decimal('0.00')), output_field=models.DecimalField()),
+    }
+
+
+def capped_increment(amount):
+    """`quantity + amount` limitado al stock actual del producto, sin reducir la línea."""
+    stock = Product.all_objects.filter(pk=OuterRef('product_id')).values('stock')[:1]
+    return Greatest(F('quantity'), Least(F('quantity') + amount, Subquery(stock)))
+
 
 class OrderProduct(models.Model):
     order = models.ForeignKey(Order, related_name='order_products', on_delete=models.CASCADE, verbose_name='Order (id_pedido)')
@@ -57,85 +122,141 @@ class OrderProduct(models.Model):
     class Meta:
         verbose_name = "Ordered Product"
         verbose_name_plural = "Ordered Products"
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
 
     def __str__(self):
         name = self.product_name or (self.product.name if self.product else '(producto eliminado)')
         return f"OrderProduct: {self.quantity} x {name} (Order {self.order.id})"
 
+    def _needs_snapshot(self, update_fields):
+        if self.product_id is None:
+            return False
+        if update_fields is not None:
+            # save(update_fields=[...]) solo escribe esos campos: no cargar el producto
+            return any(f in update_fields for f in ('product_name', 'price_at_order'))
+        return self._state.adding or not self.product_name or self.price_at_order is None
+
+    def _fill_snapshot(self):
+        product = self.product
+        if not self.product_name:
+            self.product_name = product.name
+        if self.price_at_order is None:
+            self.price_at_order = product.price
+        if not self.product_image:
+            self.product_image = _product_image_value(product)
+
     def save(self, *args, **kwargs):
-        if self.product:
-            try:
-                if not self.product_name:
-                    self.product_name = self.product.name
-            except Exception:
-                pass
-            try:
-                if not self.product_image:
-                    img = getattr(self.product, 'image', None)
-                    if img:
-                        try:
-                            self.product_image = img.url
-                        except Exception:
-                            self.product_image = getattr(img, 'name', None)
-            except Exception:
-                pass
-            try:
-                if not self.price_at_order:
-                    self.price_at_order = self.product.price
-            except Exception:
-                pass
-
-        if not self.product and not self.product_name:
+        # Solo se resuelve el producto (consulta de la FK) al crear la línea o si
+        # falta el snapshot; los cambios de cantidad no lo tocan
+        if self._needs_snapshot(kwargs.get('update_fields')):
+            self._fill_snapshot()
+
+        if self.product_id is None and not self.product_name:
             self.product_name = '(producto eliminado)'
 
         super().save(*args, **kwargs)
 
 
+def _product_image_value(product):
+    img = getattr(product, 'image', None)
+    if not img:
+        return None
+    try:
+        return img.url
+    except ValueError:
+        return img.name
+
+
+def remove_product_from_carts(product):
+    """Quita `product` de los carritos abiertos y recalcula sus totales."""
+    cart_lines = OrderProduct.objects.filter(product=product, order__status='EN_CARRITO')
+    cart_ids = list(cart_lines.values_list('order_id', flat=True))
+    if cart_ids:
+        cart_lines.delete()
+        Order.objects.filter(id__in=cart_ids).update(**order_totals())
+
+
+def snapshot_and_detach_product(product):
+    """Prepara las líneas de pedido de `product` para que pueda borrarse.
+
+    Las líneas de carritos se eliminan (y se recalculan sus totales). En el
+    historial se copian nombre, imagen y precio del producto en los campos
+    de snapshot que estén vacíos y se desvinculan, todo en un único UPDATE,
+    sea cual sea el número de líneas.
+    """
+    remove_product_from_carts(product)
+
+    snapshot = {
+        'product_name': Coalesce(NullIf(F('product_name'), Value('')), Value(product.name, output_field=models.CharField())),
+        'price_at_order': Coalesce(
+            NullIf(F('price_at_order'), Value(Decimal('0'))),
+            Value(product.price, output_field=models.DecimalField(max_digits=8, decimal_places=2)),
+        ),
+    }
+    image = _product_image_value(product)
+    if image:
+        snapshot['product_image'] = Coalesce(NullIf(F('product_image'), Value('')), Value(image, output_field=models.CharField()))
+
+    OrderProduct.objects.filter(product=product).update(product=None, **snapshot)
+
+
 @receiver(pre_delete, sender=Product)
 def handle_product_pre_delete(sender, instance, **kwargs):
+    snapshot_and_detach_product(instance)
 
-    try:
-        cart_lines = OrderProduct.objects.filter(product=instance, order__status='EN_CARRITO')
-        if cart_lines.exists():
-            cart_lines.delete()
-
-        hist_lines = OrderProduct.objects.filter(product=instance).exclude(order__status='EN_CARRITO')
-        for l in hist_lines:
-            changed = False
-            if not getattr(l, 'product_name', None):
-                l.product_name = instance.name
-                changed = True
-            if not getattr(l, 'product_image', None):
-                img = getattr(instance, 'image', None)
-                if img:
-                    try:
-                        l.product_image = img.url
-                    except Exception:
-                        l.product_image = getattr(img, 'name', None)
-                    changed = True
-            if not getattr(l, 'price_at_order', None):
-                try:
-                    l.price_at_order = instance.price
-                    changed = True
-                except Exception:
-                    pass
-            if changed:
-                l.save()
-
-        try:
-            with transaction.atomic():
-                hist_lines.update(product=None)
-        except IntegrityError:
-            placeholder, _ = Product.objects.get_or_create(
-                name='(producto eliminado)',
-                defaults={
-                    'ref': None,
-                    'price': 0,
-                    'flavor': None,
-                    'size': None,
-                    'stock': 0,
-                }
-            )
-            hist_lines.update(product=placeholder)
-    except Exception:
-        pass
\ No newline at end of file
+
+def merge_cart_lines(source, cart):
+    """Pasa las líneas del pedido `source` al carrito `cart` y borra `source`.
+
+    Las de productos que ya están en `cart` suman su cantidad (limitada al
+    stock) en un único UPDATE; el resto se mueven con otro UPDATE (las de
+    productos sin stock se descartan). Debe ejecutarse dentro de una
+    transacción.
+    """
+    source_lines = OrderProduct.objects.filter(order=source, product__isnull=False)
+    in_cart = OrderProduct.objects.filter(order=cart).values('product_id')
+    added = source_lines.filter(product_id=OuterRef('product_id')).values('quantity')[:1]
+
+    OrderProduct.objects.filter(order=cart, product_id__in=source_lines.values('product_id')).update(
+        quantity=capped_increment(Subquery(added))
+    )
+    stock = Product.all_objects.filter(pk=OuterRef('product_id')).values('stock')[:1]
+    source_lines.exclude(product_id__in=in_cart).filter(product__stock__gt=0).update(
+        order=cart, quantity=Least(F('quantity'), Subquery(stock))
+    )
+    source.delete()
+    cart.refresh_totals()
+
+
+def merge_anonymous_cart(cookie, user):
+    """Pasa el carrito anónimo de `cookie` al carrito activo de `user`.
+
+    Si el usuario no tiene carrito, el anónimo pasa a ser suyo; si lo tiene,
+    se funden con `merge_cart_lines`. Devuelve el carrito resultante, o None
+    si no había carrito anónimo.
+    """
+    with transaction.atomic():
+        anonymous = Order.objects.select_for_update().filter(status='EN_CARRITO', anonymous_user_cookie=cookie).first()
+        if anonymous is None:
+            return None
+        cart = Order.objects.filter(status='EN_CARRITO', registered_user=user).first()
+        if cart is None:
+            Order.objects.filter(pk=anonymous.pk).update(registered_user=user, anonymous_user_cookie=None, updated_at=timezone.now())
+            anonymous.refresh_from_db()
+            return anonymous
+        merge_cart_lines(anonymous, cart)
+    return cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    cookie = request.COOKIES.get('anon_user_id') if request is not None else None
+    if not cookie:
+        return
+    merge_anonymous_cart(cookie, user)
+    # Si la petición ya había resuelto el carrito (RequestCart), era el anónimo
+    cart = getattr(request, 'cart', None)
+    if cart is not None:
+        cart.invalidate()
@@ -0,0 +1,59 @@
+"""Limpieza de carritos anónimos abandonados.
+
+Cada visitante anónimo que añade algo al carrito crea un pedido
+`EN_CARRITO` ligado a su cookie `anon_user_id`, que caduca a los
+`ANONYMOUS_CART_TTL_DAYS` días. Pasado ese tiempo sin cambios
+(`Order.updated_at`) nadie puede volver a ese carrito, así que se borra
+junto con sus líneas, por lotes.
+
+Se ejecuta con `python manage.py reap_carts`, programado fuera de la web
+(cron o el planificador de la plataforma), p. ej. cada noche:
+
+    0 4 * * * cd /srv/natursur && python manage.py reap_carts
+
+No se lanza desde los procesos de la aplicación: cada worker de gunicorn y
+cada comando (`migrate`, `collectstatic`...) lo ejecutaría por su cuenta.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from main.orders.models import Order, OrderProduct
+
+
+def cart_ttl():
+    return datetime.timedelta(days=getattr(settings, 'ANONYMOUS_CART_TTL_DAYS', 30))
+
+
+def stale_anonymous_carts(older_than=None, now=None):
+    cutoff = (now or timezone.now()) - (older_than if older_than is not None else cart_ttl())
+    return Order.objects.filter(status='EN_CARRITO', registered_user__isnull=True, updated_at__lt=cutoff)
+
+
+def reap_carts(older_than=None, batch_size=1000, dry_run=False):
+    """Borra los carritos anónimos sin cambios desde hace `older_than`.
+
+    Devuelve `{'carts': n, 'lines': m}` con las filas borradas (o las que se
+    borrarían con `dry_run`). Cada lote va en su propia transacción y vuelve
+    a comprobar el filtro, así que un carrito que se toca mientras tanto no
+    se borra.
+    """
+    stale = stale_anonymous_carts(older_than)
+    if dry_run:
+        return {'carts': stale.count(), 'lines': OrderProduct.objects.filter(order__in=stale).count()}
+
+    reclaimed = {'carts': 0, 'lines': 0}
+    while True:
+        ids = list(stale.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            _, deleted = stale.filter(pk__in=ids).delete()
+        reclaimed['carts'] += deleted.get('orders.Order', 0)
+        reclaimed['lines'] += deleted.get('orders.OrderProduct', 0)
+        if len(ids) < batch_size:
+            break
+    return reclaimed
+
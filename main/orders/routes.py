@@ -1,12 +1,14 @@
 from django.urls import path
-from django.conf import settings
 from main.orders import views
-from django.conf.urls.static import static
 
 
 urlpatterns = [
 	path('carrito/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
+	path('carrito/add/batch/', views.add_to_cart_batch, name='add_to_cart_batch'),
 	path('carrito/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+	path('carrito/add/<int:product_id>/json/', views.add_to_cart_json, name='add_to_cart_json'),
+	path('carrito/remove/<int:item_id>/json/', views.remove_from_cart_json, name='remove_from_cart_json'),
+	path('carrito/update/<int:item_id>/json/', views.update_cart_line_json, name='update_cart_line_json'),
 	path('carrito/', views.view_cart, name='view_cart'),
 	path('pedidos/', views.show_orders, name='show_orders'),
 	path('pedidos/admin/', views.show_orders_admin, name='show_orders_admin'),
@@ -16,6 +18,4 @@ urlpatterns = [
     
     path('pedidos/<int:order_id>/eliminar/', views.delete_order, name='delete_order'),
 	path('solicitud/finalizar/', views.finalize_order, name='finalize_order'),
-]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
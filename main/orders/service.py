@@ -1,7 +1,10 @@
 from ..products.models import Product
-from main.orders.models import Order, OrderProduct
+from main.orders.models import Order, OrderProduct, capped_increment
+from main.orders.cart import RequestCart
 import datetime
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Least
 import uuid
 from django.core.exceptions import ValidationError
 
@@ -17,12 +20,20 @@ class InsufficientStockError(Exception):
         self.removed = removed
 
 
+CART_DEFAULTS = {
+    'solicitant_name': "",
+    'solicitant_contact': "",
+    'solicitant_address': "",
+    'order_identified': None,
+    'is_paid': False,
+}
+
+
 class ProductService:
 
 
     @transaction.atomic
     def add_product_to_cart(request, product_data, requested_quantity=1):
-        anon_cookie_to_set = None
         product_id = product_data.get('id')
 
         product = None
@@ -32,60 +43,193 @@ class ProductService:
             product_vals = {k: v for k, v in product_data.items() if k in ['name', 'ref', 'price', 'flavor', 'size', 'image']}
             product, _ = Product.objects.get_or_create(ref=product_vals.get('ref'), defaults=product_vals)
 
-        order = None
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            order = Order.objects.filter(status='EN_CARRITO', registered_user=request.user).first()
-        else:
-            cookie = request.COOKIES.get('anon_user_id')
-            if cookie:
-                order = Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie).first()
+        _, lines, anon_cookie_to_set = ProductService.add_products_to_cart(
+            request, [(product.id, requested_quantity)], products={product.id: product},
+        )
+        return lines.get(product.id), anon_cookie_to_set
 
+    @staticmethod
+    def _cart_owner(user, cookies):
+        """Filtro del dueño del carrito y la cookie anónima nueva a enviar (o None)."""
+        if user is not None and user.is_authenticated:
+            return {'registered_user': user}, None
+        cookie = cookies.get('anon_user_id')
+        if cookie:
+            return {'anonymous_user_cookie': cookie}, None
+        cookie = uuid.uuid4().hex
+        return {'anonymous_user_cookie': cookie}, cookie
 
-        if not order:
-            if not (hasattr(request, 'user') and request.user.is_authenticated):
-                cookie = request.COOKIES.get('anon_user_id')
-                if not cookie:
-                    cookie = uuid.uuid4().hex
-                    anon_cookie_to_set = cookie
-            else:
-                cookie = None
-
-            order = Order.objects.create(
-                solicitant_name="",
-                solicitant_contact="",
-                solicitant_address="",
-                order_identified=None,
-                anonymous_user_cookie=(cookie if not (hasattr(request, 'user') and request.user.is_authenticated) else None),
-                registered_user=(request.user if hasattr(request, 'user') and request.user.is_authenticated else None),
-                is_paid=False,
-                status='EN_CARRITO',
-            )
+    @staticmethod
+    def get_or_create_cart(request):
+        """Carrito activo de la petición, creándolo si no existe.
 
+        Devuelve `(order, cookie)`; `cookie` es la nueva cookie anónima que hay
+        que enviar al cliente, o None. La restricción `unique_active_cart_*`
+        garantiza un solo carrito activo: si otra petición lo crea a la vez,
+        get_or_create recupera el suyo.
+        """
+        owner, anon_cookie_to_set = ProductService._cart_owner(getattr(request, 'user', None), request.COOKIES)
+        order, _ = Order.objects.get_or_create(status='EN_CARRITO', **owner, defaults=CART_DEFAULTS)
+        return order, anon_cookie_to_set
 
+    @staticmethod
+    async def aget_or_create_cart(request):
+        owner, anon_cookie_to_set = ProductService._cart_owner(await request.auser(), request.COOKIES)
+        order, _ = await Order.objects.aget_or_create(status='EN_CARRITO', **owner, defaults=CART_DEFAULTS)
+        return order, anon_cookie_to_set
+
+    @staticmethod
+    async def aget_cart(request):
+        """Carrito activo de la petición sin crearlo (None si no hay)."""
+        user = await request.auser()
+        if not user.is_authenticated and not request.COOKIES.get('anon_user_id'):
+            return None
+        owner, _ = ProductService._cart_owner(user, request.COOKIES)
+        return await Order.objects.filter(status='EN_CARRITO', **owner).afirst()
+
+    @staticmethod
+    def _normalize_quantity(value):
         try:
-            requested_quantity = int(requested_quantity)
-        except (TypeError, ValueError):
-            requested_quantity = 1
+            value = int(value)
+        except (TypeError, ValueError, OverflowError):
+            value = 1
+        return max(value, 1)
+
+    @transaction.atomic
+    def add_products_to_cart(request, items, products=None):
+        """Añade varios `(product_id, cantidad)` al carrito en una sola transacción.
+
+        Lee productos y líneas existentes con una consulta cada uno, incrementa
+        todas las líneas existentes con un único UPDATE (limitado al stock
+        actual, sin reducir las que ya lo superaban) y crea las nuevas con
+        `bulk_create`. Los productos inexistentes, archivados o sin stock se
+        ignoran. Devuelve `(order, {product_id: OrderProduct}, cookie)`.
+        """
+        requested = {}
+        for product_id, quantity in items:
+            requested[product_id] = requested.get(product_id, 0) + ProductService._normalize_quantity(quantity)
+
+        if products is None:
+            products = Product.objects.in_bulk(list(requested))
+        # Nunca se pide más que el stock: la cantidad llega acotada a SQL
+        requested = {pid: min(qty, max(products[pid].stock, 0)) for pid, qty in requested.items() if pid in products}
+        order, anon_cookie_to_set = ProductService.get_or_create_cart(request)
+
+        existing = {
+            line.product_id: line
+            for line in OrderProduct.objects.filter(order=order, product_id__in=list(products))
+        }
+        previous = {product_id: line.quantity for product_id, line in existing.items()}
+
+        to_increment = [pid for pid in existing if products[pid].stock > 0]
+        if to_increment:
+            increment = Case(
+                *[When(product_id=pid, then=Value(requested[pid])) for pid in to_increment],
+                output_field=IntegerField(),
+            )
+            OrderProduct.objects.filter(order=order, product_id__in=to_increment).update(quantity=capped_increment(increment))
 
-        if requested_quantity < 1:
-            requested_quantity = 1
+        new_lines = [
+            OrderProduct(order=order, product=product, quantity=min(requested[pid], product.stock))
+            for pid, product in products.items()
+            if pid not in existing and pid in requested and product.stock > 0
+        ]
+        for line in new_lines:
+            line._fill_snapshot()
+        if new_lines:
+            try:
+                with transaction.atomic():
+                    OrderProduct.objects.bulk_create(new_lines)
+            except IntegrityError:
+                # Otra petición creó alguna de estas líneas a la vez: se suman
+                # una a una sobre la que ya existe
+                for line in new_lines:
+                    created_line, created = OrderProduct.objects.get_or_create(
+                        order=order, product=line.product,
+                        defaults={'quantity': line.quantity, 'price_at_order': line.price_at_order},
+                    )
+                    if not created:
+                        OrderProduct.objects.filter(pk=created_line.pk).update(
+                            quantity=capped_increment(requested[line.product_id])
+                        )
 
-        line = OrderProduct.objects.filter(order=order, product=product).first()
-        if line:
+        lines = existing
+        if to_increment or new_lines:
+            lines = {
+                line.product_id: line
+                for line in OrderProduct.objects.filter(order=order, product_id__in=list(products))
+            }
+            if any(line.quantity != previous.get(pid) for pid, line in lines.items()):
+                order.refresh_totals()
+        for line in lines.values():
+            line.order = order
+        return order, lines, anon_cookie_to_set
 
-            max_addable = max(product.stock - line.quantity, 0)
-            to_add = min(requested_quantity, max_addable)
-            if to_add > 0:
-                line.quantity += to_add
-                line.save()
+    @staticmethod
+    async def aadd_product_to_cart(request, product, requested_quantity=1):
+        """Versión asíncrona de `add_product_to_cart` para las vistas JSON.
+
+        Cada paso es una sola sentencia segura ante concurrencia (get_or_create
+        del carrito y de la línea, incremento con `capped_increment`), así que
+        no necesita una transacción envolvente. Devuelve `(order, line, cookie)`.
+        """
+        quantity = ProductService._normalize_quantity(requested_quantity)
+        order, anon_cookie_to_set = await ProductService.aget_or_create_cart(request)
+        if product.stock < 1:
+            line = await OrderProduct.objects.filter(order=order, product=product).afirst()
+            return order, line, anon_cookie_to_set
+        quantity = min(quantity, product.stock)
+
+        line, created = await OrderProduct.objects.aget_or_create(
+            order=order,
+            product=product,
+            defaults={'quantity': min(quantity, product.stock), 'price_at_order': product.price},
+        )
+        if not created:
+            await OrderProduct.objects.filter(pk=line.pk).aupdate(quantity=capped_increment(quantity))
+            await line.arefresh_from_db(fields=['quantity'])
+        await order.arefresh_totals()
+        return order, line, anon_cookie_to_set
+
+    @staticmethod
+    async def aset_line_quantity(order, line_id, quantity):
+        """Fija la cantidad de una línea de `order`, limitada al stock.
+
+        Con 0, o si el producto se ha quedado sin stock, la línea se borra.
+        Devuelve la línea (con `quantity` 0 si se ha borrado). Lanza
+        `OrderProduct.DoesNotExist` si la línea no es de ese carrito.
+        """
+        line = await OrderProduct.objects.select_related('product').aget(pk=line_id, order=order)
+        quantity = min(quantity, max(line.product.stock if line.product else 0, 0))
+        to_delete = OrderProduct.objects.filter(pk=line.pk)
+        if quantity > 0:
+            # El stock puede haber cambiado desde la lectura: se vuelve a limitar
+            # en el UPDATE y se borra la línea solo si ha quedado a 0
+            stock = Product.all_objects.filter(pk=OuterRef('product_id')).values('stock')[:1]
+            await to_delete.aupdate(quantity=Least(Value(quantity), Coalesce(Subquery(stock), Value(0))))
+            to_delete = to_delete.filter(quantity__lt=1)
+        deleted, _ = await to_delete.adelete()
+        if deleted:
+            line.quantity = 0
         else:
-            to_add = min(requested_quantity, max(product.stock, 0))
-            if to_add > 0:
-                line = OrderProduct.objects.create(order=order, product=product, quantity=to_add, price_at_order=product.price)
-            else:
-                line = None
+            await line.arefresh_from_db(fields=['quantity'])
+        await order.arefresh_totals()
+        return line
 
-        return line, anon_cookie_to_set
+    @staticmethod
+    async def aremove_one_from_cart(order, line_id):
+        """Resta una unidad a una línea de `order` y la borra al llegar a cero.
+
+        Misma semántica que `remove_product_from_cart` para una línea.
+        """
+        line = await OrderProduct.objects.select_related('product').aget(pk=line_id, order=order)
+        if await OrderProduct.objects.filter(pk=line.pk, quantity__gt=1).aupdate(quantity=F('quantity') - 1):
+            await line.arefresh_from_db(fields=['quantity'])
+        else:
+            await OrderProduct.objects.filter(pk=line.pk).adelete()
+            line.quantity = 0
+        await order.arefresh_totals()
+        return line
 
     @transaction.atomic
     def remove_product_from_cart(order_id):
@@ -98,10 +242,12 @@ class ProductService:
         if line and line.order.status == 'EN_CARRITO':
             if line.quantity <= 1:
                 line.delete()
+                line.order.refresh_totals()
                 return True
             else:
                 line.quantity -= 1
-                line.save()
+                line.save(update_fields=['quantity'])
+                line.order.refresh_totals()
                 return line
 
 
@@ -113,12 +259,54 @@ class ProductService:
         return False
         
     @staticmethod
-    def get_active_cart_for_request(request):
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            return Order.objects.filter(status='EN_CARRITO', registered_user=request.user).first()
-        else:
-            cookie = request.COOKIES.get('anon_user_id')
-            if cookie:
-                return Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie).first()
-        return None
+    def reserve_stock(lines, batch_size=100):
+        """Descuenta del stock las cantidades de `lines` sin sobrevender.
+
+        Cada lote de productos se descuenta con un único UPDATE condicional
+        (`stock = stock - qty WHERE stock >= qty`). Si el número de filas
+        afectadas no cuadra con el de productos pedidos, se revierte todo y se
+        lanza `InsufficientStockError` con las líneas que no se pueden servir.
+        """
+        requested = {}
+        for line in lines:
+            qty = int(line.quantity or 0)
+            if line.product_id and qty > 0:
+                requested[line.product_id] = requested.get(line.product_id, 0) + qty
+
+        items = list(requested.items())
+        try:
+            with transaction.atomic():
+                updated = 0
+                for start in range(0, len(items), batch_size):
+                    batch = items[start:start + batch_size]
+                    condition = Q()
+                    for product_id, qty in batch:
+                        condition |= Q(pk=product_id, stock__gte=qty)
+                    updated += Product.objects.filter(condition).update(stock=Case(
+                        *[When(pk=product_id, then=F('stock') - qty) for product_id, qty in batch],
+                        default=F('stock'),
+                        output_field=IntegerField(),
+                    ))
+                if updated != len(items):
+                    raise InsufficientStockError([])
+        except InsufficientStockError:
+            available = dict(Product.objects.filter(pk__in=requested).values_list('id', 'stock'))
+            removed = []
+            for line in lines:
+                if not line.product_id or line.product_id not in requested:
+                    continue
+                stock = int(available.get(line.product_id) or 0)
+                if requested[line.product_id] > stock:
+                    removed.append({
+                        'line_id': line.id,
+                        'product_id': line.product_id,
+                        'product_ref': line.product.ref,
+                        'product_name': line.product.name,
+                        'quantity_requested': int(line.quantity or 0),
+                        'available': stock,
+                    })
+            raise InsufficientStockError(removed)
 
+    @staticmethod
+    def get_active_cart_for_request(request):
+        return RequestCart.for_request(request).order
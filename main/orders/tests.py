@@ -1,8 +1,20 @@
+import datetime
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from django.test import RequestFactory, TestCase
+from io import StringIO
+from django.core.management import call_command
+from unittest import skipUnless
+from django.db import IntegrityError, OperationalError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from main.orders import views as order_views
+from main.orders.reaper import reap_carts
 from main.orders.service import ProductService
 
 from main.orders.models import Order, OrderProduct
@@ -335,8 +347,622 @@ class OrderViewsTests(TestCase):
         self.assertFalse(ProductService.remove_product_from_cart(line3.id))
         self.assertTrue(OrderProduct.objects.filter(id=line3.id).exists())
         
-        order3 = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        order3 = Order.objects.create(status='EN_CARRITO', anonymous_user_cookie='anon')
         self.assertTrue(ProductService.remove_product_from_cart(order3.id))
         self.assertFalse(Order.objects.filter(id=order3.id).exists())
         
         self.assertFalse(ProductService.remove_product_from_cart(99999))
+
+
+class OrderCountersTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.p1 = Product.objects.create(name='Prod1', price=Decimal('1.50'), stock=5)
+        self.p2 = Product.objects.create(name='Prod2', price=Decimal('2.25'), stock=5)
+        self.factory = RequestFactory()
+
+    def _add(self, product, quantity):
+        req = self.factory.post('/')
+        req.user = self.user
+        return ProductService.add_product_to_cart(req, {'id': product.id}, requested_quantity=quantity)
+
+    def test_add_and_remove_keep_counters_in_sync(self):
+        self._add(self.p1, 2)
+        line, _ = self._add(self.p2, 1)
+        order = line.order
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 3)
+        self.assertEqual(order.total_amount, Decimal('5.25'))
+
+        ProductService.remove_product_from_cart(line.id)
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(order.total_amount, Decimal('3.00'))
+
+    def test_cart_status_reads_counter_column(self):
+        self._add(self.p1, 2)
+        self.client.login(username='user', password='pass')
+        resp = self.client.get(reverse('view_cart'))
+        self.assertEqual(resp.context['cart_item_count'], 2)
+
+    def test_recalculate_order_totals_command_fixes_stale_counters(self):
+        order = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        OrderProduct.objects.create(order=order, product=self.p1, quantity=4, price_at_order=Decimal('1.50'))
+
+        out = StringIO()
+        call_command('recalculate_order_totals', '--check', stdout=out)
+        self.assertIn('mismatched: 1', out.getvalue())
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 0)
+
+        call_command('recalculate_order_totals', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 4)
+        self.assertEqual(order.total_amount, Decimal('6.00'))
+
+
+class BatchAddToCartTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.p1 = Product.objects.create(name='Prod1', price=Decimal('1.50'), stock=5)
+        self.p2 = Product.objects.create(name='Prod2', price=Decimal('2.00'), stock=3)
+        self.empty = Product.objects.create(name='Empty', price=Decimal('1.00'), stock=0)
+        self.url = reverse('add_to_cart_batch')
+
+    def _post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_batch_creates_and_increments_lines(self):
+        self.client.login(username='user', password='pass')
+        self._post({'items': [{'product_id': self.p1.id, 'quantity': 2}]})
+
+        resp = self._post({'items': [
+            {'product_id': self.p1.id, 'quantity': 2},
+            {'product_id': self.p2.id, 'quantity': 10},
+            [self.empty.id, 1],
+            [99999, 1],
+        ]})
+
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        quantities = {item['product_id']: item['quantity'] for item in data['items']}
+        self.assertEqual(quantities, {self.p1.id: 4, self.p2.id: 3})
+        self.assertEqual(data['skipped'], [self.empty.id, 99999])
+        self.assertEqual(data['cart']['item_count'], 7)
+        self.assertEqual(Decimal(data['cart']['total_amount']), Decimal('12.00'))
+        self.assertEqual(Order.objects.filter(status='EN_CARRITO', registered_user=self.user).count(), 1)
+
+    def test_anonymous_batch_sets_cookie(self):
+        resp = self._post({'items': [[self.p1.id, 1]]})
+        cookie = resp.cookies['anon_user_id'].value
+        self.assertTrue(Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie).exists())
+
+    def test_invalid_payload_is_rejected(self):
+        for body in ('nope', json.dumps({'items': []}), json.dumps({'items': [{'quantity': 1}]})):
+            resp = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_oversized_quantities_are_capped_at_stock(self):
+        self.client.login(username='user', password='pass')
+        self._post({'items': [[self.p1.id, 1]]})
+
+        resp = self.client.post(reverse('add_to_cart', args=[self.p1.id]), {'quantity': '100000000000000000000'})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.post(self.url, '{"items": [[%d, 1e400], [%d, 100000000000000000000]]}' % (self.p1.id, self.p2.id),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        quantities = {item['product_id']: item['quantity'] for item in resp.json()['items']}
+        self.assertEqual(quantities, {self.p1.id: 5, self.p2.id: 3})
+        resp = self._post({'items': [[100000000000000000000, 1]]})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_query_count_does_not_grow_with_items(self):
+        self.client.login(username='user', password='pass')
+        products = [Product.objects.create(name=f'P{i}', price=Decimal('1.00'), stock=5) for i in range(10)]
+        self._post({'items': [[p.id, 1] for p in products[:1]]})
+
+        def count(items):
+            with CaptureQueriesContext(connection) as ctx:
+                self._post({'items': items})
+            return len(ctx.captured_queries)
+
+        small = count([[p.id, 1] for p in products[:2]])
+        large = count([[p.id, 1] for p in products])
+        self.assertEqual(small, large)
+
+
+class AsyncCartJsonTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.product = Product.objects.create(name='Prod', price=Decimal('2.50'), stock=4)
+
+    async def test_add_returns_line_stock_and_total(self):
+        await self.async_client.alogin(username='user', password='pass')
+        url = reverse('add_to_cart_json', args=[self.product.id])
+
+        await self.async_client.post(url, {'quantity': 3})
+        resp = await self.async_client.post(url, {'quantity': 3})
+
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data['line']['quantity'], 4)
+        self.assertEqual(data['line']['stock'], 4)
+        self.assertEqual(data['cart']['item_count'], 4)
+        self.assertEqual(Decimal(data['cart']['total_amount']), Decimal('10.00'))
+
+    async def test_anonymous_add_sets_cookie(self):
+        resp = await self.async_client.post(reverse('add_to_cart_json', args=[self.product.id]))
+        cookie = resp.cookies['anon_user_id'].value
+        self.assertTrue(await Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie).aexists())
+        self.assertEqual(resp.json()['line']['quantity'], 1)
+
+    async def test_update_and_remove_line(self):
+        await self.async_client.alogin(username='user', password='pass')
+        data = (await self.async_client.post(reverse('add_to_cart_json', args=[self.product.id]), {'quantity': 2})).json()
+        line_id = data['line']['line_id']
+
+        resp = await self.async_client.post(reverse('update_cart_line_json', args=[line_id]), {'quantity': 10})
+        self.assertEqual(resp.json()['line']['quantity'], 4)
+
+        resp = await self.async_client.post(reverse('remove_from_cart_json', args=[line_id]))
+        self.assertEqual(resp.json()['line']['quantity'], 3)
+        self.assertEqual(resp.json()['cart']['item_count'], 3)
+
+        resp = await self.async_client.post(reverse('update_cart_line_json', args=[line_id]), {'quantity': 0})
+        self.assertEqual(resp.json()['line']['quantity'], 0)
+        self.assertEqual(resp.json()['cart']['item_count'], 0)
+        self.assertFalse(await OrderProduct.objects.filter(pk=line_id).aexists())
+
+    async def test_oversized_quantities_are_capped_at_stock(self):
+        await self.async_client.alogin(username='user', password='pass')
+        url = reverse('add_to_cart_json', args=[self.product.id])
+        data = (await self.async_client.post(url)).json()
+
+        resp = await self.async_client.post(url, {'quantity': '100000000000000000000'})
+        self.assertEqual(resp.json()['line']['quantity'], 4)
+        resp = await self.async_client.post(reverse('update_cart_line_json', args=[data['line']['line_id']]), {'quantity': '100000000000000000000'})
+        self.assertEqual(resp.json()['line']['quantity'], 4)
+
+    async def test_update_of_out_of_stock_line_removes_it(self):
+        await self.async_client.alogin(username='user', password='pass')
+        data = (await self.async_client.post(reverse('add_to_cart_json', args=[self.product.id]), {'quantity': 2})).json()
+        line_id = data['line']['line_id']
+        # La sincronización o otra compra dejan el producto sin stock
+        await Product.objects.filter(pk=self.product.pk).aupdate(stock=0)
+
+        resp = await self.async_client.post(reverse('update_cart_line_json', args=[line_id]), {'quantity': 1})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['line']['quantity'], 0)
+        self.assertEqual(resp.json()['cart']['item_count'], 0)
+        self.assertFalse(await OrderProduct.objects.filter(pk=line_id).aexists())
+
+    async def test_lines_of_other_carts_are_not_found(self):
+        order = await Order.objects.acreate(status='EN_CARRITO', registered_user=self.other)
+        line = await OrderProduct.objects.acreate(order=order, product=self.product, quantity=2, price_at_order=Decimal('2.50'))
+        await self.async_client.alogin(username='user', password='pass')
+        await self.async_client.post(reverse('add_to_cart_json', args=[self.product.id]))
+
+        resp = await self.async_client.post(reverse('remove_from_cart_json', args=[line.id]))
+
+        self.assertEqual(resp.status_code, 404)
+        await line.arefresh_from_db()
+        self.assertEqual(line.quantity, 2)
+
+    async def test_invalid_requests(self):
+        self.assertEqual((await self.async_client.post(reverse('add_to_cart_json', args=[99999]))).status_code, 404)
+        self.assertEqual((await self.async_client.get(reverse('add_to_cart_json', args=[self.product.id]))).status_code, 405)
+        resp = await self.async_client.post(reverse('update_cart_line_json', args=[1]), {'quantity': 'x'})
+        self.assertEqual(resp.status_code, 400)
+
+
+class CartReaperTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='user', password='pass')
+        self.product = Product.objects.create(name='Prod', price=Decimal('1.00'), stock=10)
+        self.old = timezone.now() - datetime.timedelta(days=45)
+
+    def _cart(self, stale=True, lines=1, **owner):
+        order = Order.objects.create(status=owner.pop('status', 'EN_CARRITO'), **owner)
+        for i in range(lines):
+            product = self.product if i == 0 else Product.objects.create(name=f'P{i}', price=Decimal('1.00'), stock=1)
+            OrderProduct.objects.create(order=order, product=product, quantity=1)
+        if stale:
+            Order.objects.filter(pk=order.pk).update(updated_at=self.old)
+        return order
+
+    def test_only_stale_anonymous_carts_are_deleted(self):
+        stale = self._cart(lines=2, anonymous_user_cookie='old')
+        fresh = self._cart(stale=False, anonymous_user_cookie='new')
+        user_cart = self._cart(registered_user=self.user)
+        placed = self._cart(status='SOLICITADO', anonymous_user_cookie='placed')
+
+        out = StringIO()
+        call_command('reap_carts', stdout=out)
+
+        self.assertIn('Deleted 1 anonymous carts and 2 cart lines', out.getvalue())
+        self.assertFalse(Order.objects.filter(pk=stale.pk).exists())
+        self.assertFalse(OrderProduct.objects.filter(order_id=stale.pk).exists())
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {fresh.pk, user_cart.pk, placed.pk})
+
+    def test_batches_and_dry_run(self):
+        for i in range(3):
+            self._cart(anonymous_user_cookie=f'c{i}')
+
+        self.assertEqual(reap_carts(dry_run=True), {'carts': 3, 'lines': 3})
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(reap_carts(batch_size=2), {'carts': 3, 'lines': 3})
+        self.assertFalse(Order.objects.exists())
+
+    def test_cart_changes_touch_updated_at(self):
+        order = self._cart(anonymous_user_cookie='old')
+        order.refresh_totals()
+        self.assertGreater(order.updated_at, self.old)
+        self.assertEqual(reap_carts(), {'carts': 0, 'lines': 0})
+
+
+class CartMergeOnLoginTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='user', email='user@example.com', password='pass')
+        self.p1 = Product.objects.create(name='Prod1', price=Decimal('1.00'), stock=5)
+        self.p2 = Product.objects.create(name='Prod2', price=Decimal('2.00'), stock=5)
+        self.sold_out = Product.objects.create(name='Sold out', price=Decimal('3.00'), stock=0)
+        self.anonymous = Order.objects.create(status='EN_CARRITO', anonymous_user_cookie='anon')
+        for product, quantity in ((self.p1, 4), (self.p2, 2), (self.sold_out, 1)):
+            OrderProduct.objects.create(order=self.anonymous, product=product, quantity=quantity)
+        self.client.cookies['anon_user_id'] = 'anon'
+
+    def test_login_merges_lines_capped_at_stock(self):
+        cart = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        OrderProduct.objects.create(order=cart, product=self.p1, quantity=3)
+
+        resp = self.client.post(reverse('login'), {'username': 'user@example.com', 'password': 'pass'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse(Order.objects.filter(pk=self.anonymous.pk).exists())
+        quantities = dict(OrderProduct.objects.filter(order=cart).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.p1.id: 5, self.p2.id: 2})
+        cart.refresh_from_db()
+        self.assertEqual(cart.item_count, 7)
+        self.assertEqual(cart.total_amount, Decimal('9.00'))
+        self.assertEqual(self.client.get(reverse('view_cart')).context['cart_item_count'], 7)
+
+    def test_registration_adopts_anonymous_cart(self):
+        self.client.post(reverse('registration'), {
+            'username': 'newuser',
+            'email': 'new@example.com',
+            'password1': 'Testpass1234',
+            'password2': 'Testpass1234',
+            'first_name': 'New',
+            'last_name': 'User',
+        })
+
+        self.anonymous.refresh_from_db()
+        self.assertEqual(self.anonymous.registered_user.username, 'newuser')
+        self.assertIsNone(self.anonymous.anonymous_user_cookie)
+        self.assertEqual(OrderProduct.objects.filter(order=self.anonymous).count(), 3)
+
+    def test_login_without_anonymous_cart_changes_nothing(self):
+        self.client.cookies['anon_user_id'] = 'other'
+        self.client.post(reverse('login'), {'username': 'user', 'password': 'pass'})
+        self.assertFalse(Order.objects.filter(registered_user=self.user).exists())
+        self.assertTrue(Order.objects.filter(pk=self.anonymous.pk).exists())
+
+
+class ActiveCartConflictTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        self.p1 = Product.objects.create(name='Prod1', price=Decimal('1.00'), stock=5)
+        self.p2 = Product.objects.create(name='Prod2', price=Decimal('2.00'), stock=5)
+        self.cart = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        OrderProduct.objects.create(order=self.cart, product=self.p1, quantity=1)
+        self.placed = Order.objects.create(status='SOLICITADO', registered_user=self.user)
+        OrderProduct.objects.create(order=self.placed, product=self.p1, quantity=2)
+        OrderProduct.objects.create(order=self.placed, product=self.p2, quantity=1)
+
+    def test_edit_order_back_to_cart_is_rejected_with_message(self):
+        self.client.login(username='staff', password='pass')
+        resp = self.client.post(reverse('edit_order', args=[self.placed.id]), {'status': 'EN_CARRITO'}, follow=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('ya tiene un carrito activo', ' '.join(str(m) for m in resp.context['messages']))
+        self.placed.refresh_from_db()
+        self.assertEqual(self.placed.status, 'SOLICITADO')
+
+    def test_failed_checkout_merges_into_the_existing_cart(self):
+        cart = order_views._return_to_cart(self.placed)
+
+        self.assertEqual(cart.pk, self.cart.pk)
+        self.assertFalse(Order.objects.filter(pk=self.placed.pk).exists())
+        quantities = dict(OrderProduct.objects.filter(order=cart).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.p1.id: 3, self.p2.id: 1})
+        self.assertEqual(cart.item_count, 4)
+
+
+class OrderProductSnapshotTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.product = Product.objects.create(name='Prod', price=Decimal('1.50'), stock=10)
+        self.factory = RequestFactory()
+
+    def _add(self, quantity=1):
+        req = self.factory.post('/')
+        req.user = self.user
+        return ProductService.add_product_to_cart(req, {'id': self.product.id}, requested_quantity=quantity)
+
+    def _line_writes(self, ctx):
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE "orders_orderproduct"', 'INSERT INTO "orders_orderproduct"'))]
+
+    def test_creation_fills_snapshot(self):
+        line, _ = self._add()
+        line.refresh_from_db()
+        self.assertEqual((line.product_name, line.price_at_order), ('Prod', Decimal('1.50')))
+
+    def test_quantity_update_is_a_single_update_without_product_fetch(self):
+        line, _ = self._add()
+        line = OrderProduct.objects.get(pk=line.pk)
+
+        with self.assertNumQueries(1) as ctx:
+            line.quantity = 3
+            line.save(update_fields=['quantity'])
+        self.assertNotIn('product_name', ctx.captured_queries[0]['sql'])
+
+    def test_cart_increment_issues_a_single_line_update(self):
+        self._add()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._add(2)
+
+        writes = self._line_writes(ctx)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('SET "quantity"', writes[0])
+        # Solo la carga del producto que hace el propio servicio
+        product_selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "products_product"' in q['sql']]
+        self.assertEqual(len(product_selects), 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN checks are SQLite specific')
+class OrderIndexQueryPlanTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+
+    def assertUsesIndex(self, qs, index_name):
+        plan = qs.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_cart_lookup_by_user_uses_index(self):
+        qs = Order.objects.filter(status='EN_CARRITO', registered_user=self.user)
+        self.assertUsesIndex(qs, 'order_status_user_idx')
+
+    def test_cart_lookup_by_cookie_uses_index(self):
+        qs = Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie='abc')
+        self.assertUsesIndex(qs, 'order_status_cookie_idx')
+
+    def test_orders_by_status_sorted_by_date_use_index(self):
+        qs = Order.objects.filter(status='SOLICITADO').order_by('-date')
+        self.assertUsesIndex(qs, 'order_status_date_idx')
+        self.assertNotIn('TEMP B-TREE', qs.explain())
+
+    def test_order_identified_lookup_uses_unique_index(self):
+        qs = Order.objects.filter(order_identified='ORD-123')
+        self.assertIn('USING INDEX', qs.explain())
+
+    def test_order_product_line_lookup_uses_unique_index(self):
+        order = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        qs = OrderProduct.objects.filter(order=order, product_id=1)
+        # SQLite materializa la restricción única como un autoindex
+        self.assertUsesIndex(qs, 'order_id=? AND product_id=?')
+
+
+class OrderListQueryCountTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        p1 = Product.objects.create(name='Prod1', price=Decimal('1.50'), stock=5)
+        p2 = Product.objects.create(name='Prod2', price=Decimal('2.00'), stock=5)
+        for i in range(60):
+            order = Order.objects.create(status='SOLICITADO', registered_user=self.user)
+            OrderProduct.objects.create(order=order, product=p1, quantity=2, price_at_order=Decimal('1.50'))
+            OrderProduct.objects.create(order=order, product=p2, quantity=1, price_at_order=None)
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries), resp
+
+    def test_show_orders_admin_query_count_is_constant(self):
+        self.client.login(username='staff', password='pass')
+        small, _ = self._count_queries(reverse('show_orders_admin') + '?per_page=5')
+        with self.assertNumQueries(small):
+            resp = self.client.get(reverse('show_orders_admin') + '?per_page=50')
+        self.assertEqual(len(resp.context['orders']), 50)
+        self.assertEqual(resp.context['orders'][0].total_price, '5,00')
+
+    def test_show_orders_query_count_is_constant(self):
+        self.client.login(username='user', password='pass')
+        small, _ = self._count_queries(reverse('show_orders') + '?per_page=5')
+        with self.assertNumQueries(small):
+            resp = self.client.get(reverse('show_orders') + '?per_page=50')
+        self.assertEqual(resp.context['orders'][0].total_price, '5,00')
+        self.assertEqual(resp.context['orders'][0].total_quantity, 3)
+
+
+class ProductDeletionSnapshotTests(TestCase):
+    def _history(self, product, n):
+        orders = Order.objects.bulk_create([Order(status='SOLICITADO', anonymous_user_cookie=f'h{product.id}-{i}') for i in range(n)])
+        OrderProduct.objects.bulk_create([OrderProduct(order=o, product=product, quantity=1) for o in orders])
+
+    def _delete_queries(self, product):
+        with CaptureQueriesContext(connection) as ctx:
+            product.delete()
+        return len(ctx.captured_queries)
+
+    def test_snapshot_is_set_based(self):
+        small = Product.objects.create(name='Small', price=Decimal('2.00'))
+        large = Product.objects.create(name='Large', price=Decimal('3.00'))
+        self._history(small, 2)
+        self._history(large, 40)
+
+        self.assertEqual(self._delete_queries(small), self._delete_queries(large))
+        lines = OrderProduct.objects.filter(product_name='Large')
+        self.assertEqual(lines.count(), 40)
+        self.assertFalse(lines.exclude(price_at_order=Decimal('3.00')).exists())
+        self.assertFalse(lines.exclude(product__isnull=True).exists())
+
+    def test_blank_snapshot_fields_are_filled_and_others_kept(self):
+        product = Product.objects.create(name='Tea', price=Decimal('5.00'))
+        order = Order.objects.create(status='SOLICITADO')
+        blank = OrderProduct.objects.create(order=order, product=product, quantity=1)
+        OrderProduct.objects.filter(pk=blank.pk).update(product_name='', price_at_order=Decimal('0'))
+        kept = OrderProduct.objects.create(order=Order.objects.create(status='SOLICITADO'), product=product, quantity=1, product_name='Old Tea', price_at_order=Decimal('4.00'))
+
+        product.delete()
+
+        blank.refresh_from_db()
+        kept.refresh_from_db()
+        self.assertEqual((blank.product_name, blank.price_at_order), ('Tea', Decimal('5.00')))
+        self.assertEqual((kept.product_name, kept.price_at_order), ('Old Tea', Decimal('4.00')))
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+
+    def _finalize(self, order_id):
+        try:
+            for _ in range(50):
+                try:
+                    order = Order.objects.get(id=order_id)
+                    success, _ = order_views._mark_order_as_paid(order)
+                    return success
+                except OperationalError:
+                    # SQLite en memoria compartida bloquea la tabla en vez de esperar
+                    time.sleep(0.01)
+            return None
+        finally:
+            connection.close()
+
+    def test_concurrent_finalizations_never_oversell(self):
+        product = Product.objects.create(name='Hot', price=Decimal('3.00'), stock=5)
+        order_ids = []
+        for i in range(20):
+            order = Order.objects.create(status='SOLICITADO', anonymous_user_cookie=f'c{i}')
+            OrderProduct.objects.create(order=order, product=product, quantity=1, price_at_order=product.price)
+            order_ids.append(order.id)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(self._finalize, order_ids))
+
+        self.assertNotIn(None, results)
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.filter(is_paid=True).count(), 5)
+
+    def test_double_submit_reserves_stock_once(self):
+        product = Product.objects.create(name='Hot', price=Decimal('3.00'), stock=5)
+        order = Order.objects.create(status='SOLICITADO')
+        OrderProduct.objects.create(order=order, product=product, quantity=2, price_at_order=product.price)
+        # Dos peticiones que leyeron el pedido antes de que ninguna lo pagase
+        first, second = Order.objects.get(id=order.id), Order.objects.get(id=order.id)
+
+        self.assertEqual(order_views._mark_order_as_paid(first), (True, []))
+        self.assertEqual(order_views._mark_order_as_paid(second), (True, []))
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+        self.assertEqual(second.order_identified, first.order_identified)
+
+    def test_shortage_rolls_back_every_line(self):
+        plenty = Product.objects.create(name='Plenty', price=Decimal('1.00'), stock=10)
+        scarce = Product.objects.create(name='Scarce', price=Decimal('1.00'), stock=1)
+        order = Order.objects.create(status='SOLICITADO')
+        OrderProduct.objects.create(order=order, product=plenty, quantity=4, price_at_order=plenty.price)
+        scarce_line = OrderProduct.objects.create(order=order, product=scarce, quantity=2, price_at_order=scarce.price)
+
+        success, removed = order_views._mark_order_as_paid(order)
+
+        self.assertFalse(success)
+        self.assertEqual([item['line_id'] for item in removed], [scarce_line.id])
+        self.assertEqual(removed[0]['available'], 1)
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.stock, 10)
+        order.refresh_from_db()
+        self.assertFalse(order.is_paid)
+
+class ConcurrentCartAddTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='buyer', password='pass')
+        self.factory = RequestFactory()
+
+    def _add(self, args):
+        product_id, owner = args
+        request = self.factory.post('/')
+        if isinstance(owner, str):
+            request.COOKIES['anon_user_id'] = owner
+            request.user = AnonymousUser()
+        else:
+            request.user = owner
+        try:
+            for _ in range(100):
+                try:
+                    line, _ = ProductService.add_product_to_cart(request, {'id': product_id}, 1)
+                    return line.id
+                except OperationalError:
+                    # SQLite en memoria compartida bloquea la tabla en vez de esperar
+                    time.sleep(0.01)
+            return None
+        finally:
+            connection.close()
+
+    def _hammer(self, product, owner, times=24):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            return list(pool.map(self._add, [(product.id, owner)] * times))
+
+    def test_parallel_adds_share_cart_and_line(self):
+        product = Product.objects.create(name='Hot', price=Decimal('2.00'), stock=100)
+
+        results = self._hammer(product, self.user)
+
+        self.assertNotIn(None, results)
+        cart = Order.objects.get(status='EN_CARRITO', registered_user=self.user)
+        line = OrderProduct.objects.get(order=cart)
+        self.assertEqual(set(results), {line.id})
+        self.assertEqual(line.quantity, 24)
+        self.assertEqual(cart.item_count, 24)
+        self.assertEqual(cart.total_amount, Decimal('48.00'))
+
+    def test_parallel_adds_are_capped_at_stock(self):
+        product = Product.objects.create(name='Scarce', price=Decimal('1.00'), stock=10)
+
+        results = self._hammer(product, 'cookie-1')
+
+        self.assertNotIn(None, results)
+        self.assertEqual(Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie='cookie-1').count(), 1)
+        self.assertEqual(OrderProduct.objects.get(product=product).quantity, 10)
+
+    def test_only_one_active_cart_per_owner(self):
+        Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+        Order.objects.create(status='SOLICITADO', registered_user=self.user)
+        with self.assertRaises(IntegrityError):
+            Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+
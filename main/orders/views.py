@@ -1,31 +1,34 @@
+from django.conf import settings
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db.models.functions import Coalesce
-from django.db.models import Sum, Q
+from django.db.models import DecimalField, F, Q, Sum, Value
 from django.core.paginator import Paginator
-from django.db import transaction
-from main.orders.models import Order, OrderProduct
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.db import IntegrityError, transaction
+from main.orders.models import Order, OrderProduct, merge_cart_lines
 from main.products.models import Product
 from .forms import OrderForm
-from main.orders.service import ProductService
+from main.orders.service import InsufficientStockError, ProductService
+from main.orders.cart import RequestCart
 from decimal import Decimal, ROUND_HALF_UP
 from django.contrib import messages
 import datetime
+import json
 import uuid
 
+MAX_BATCH_ITEMS = 100
+MAX_DB_INTEGER = 2 ** 63 - 1
+ANON_COOKIE_MAX_AGE = 60 * 60 * 24 * getattr(settings, 'ANONYMOUS_CART_TTL_DAYS', 30)
+
+
 def is_admin(user):
     return user.is_active and user.is_staff
 
 def list_user_cart_order(request):
-    order = None
-    if hasattr(request, 'user') and request.user.is_authenticated:
-        order = Order.objects.filter(status='EN_CARRITO', registered_user=request.user).first()
-    else:
-        cookie = request.COOKIES.get('anon_user_id')
-        if cookie:
-            order = Order.objects.filter(status='EN_CARRITO', anonymous_user_cookie=cookie).first()
-    return order
+    return RequestCart.for_request(request).order
 
 
 def _format_price(value):
@@ -35,10 +38,10 @@ def _format_price(value):
         return str(value)
 
 
-def _prepare_order_lines(order, exclude_deleted=False):
-    qs = OrderProduct.objects.filter(order=order).select_related('product')
+def _prepare_order_lines(order, exclude_deleted=False, lines=None):
+    qs = lines if lines is not None else OrderProduct.objects.filter(order=order).select_related('product')
     if exclude_deleted:
-        qs = qs.exclude(product__isnull=True).exclude(product__name='(producto eliminado)')
+        qs = qs.filter(product__is_active=True)
 
     items = []
     total = Decimal('0.00')
@@ -60,6 +63,13 @@ def _prepare_order_lines(order, exclude_deleted=False):
     return items, total
 
 
+def _order_total_expression(line_filter=None):
+    """Total del pedido calculado en la propia consulta (cantidad × precio de cada línea)."""
+    money = DecimalField(max_digits=10, decimal_places=2)
+    line_total = F('order_products__quantity') * Coalesce('order_products__price_at_order', 'order_products__product__price')
+    return Coalesce(Sum(line_total, filter=line_filter, output_field=money), Value(Decimal('0.00')), output_field=money)
+
+
 def add_to_cart(request, product_id):
     if request.method != 'POST':
         return redirect('list_products')
@@ -75,17 +85,10 @@ def add_to_cart(request, product_id):
     if quantity < 1:
         quantity = 1
 
-    product = Product.objects.get(id=product_id)
+    product = get_object_or_404(Product, id=product_id)
 
-    order_line, anon_cookie = ProductService.add_product_to_cart(request, {
-        'id': product.id,
-        'name': product.name,
-        'ref': product.ref,
-        'price': product.price,
-        'flavor': product.flavor,
-        'size': product.size,
-        'image': product.image,
-    }, requested_quantity=quantity)
+    _, lines, anon_cookie = ProductService.add_products_to_cart(request, [(product.id, quantity)], products={product.id: product})
+    order_line = lines.get(product.id)
 
     added_qty = 0
     if order_line:
@@ -106,15 +109,125 @@ def add_to_cart(request, product_id):
 
     resp = redirect(redirect_url)
     if anon_cookie:
-        resp.set_cookie('anon_user_id', anon_cookie, max_age=60*60*24*30)
+        resp.set_cookie('anon_user_id', anon_cookie, max_age=ANON_COOKIE_MAX_AGE)
     return resp
 
+def _cart_json(order):
+    return {
+        'id': order.id,
+        'item_count': int(order.item_count or 0),
+        'total_amount': str(order.total_amount or Decimal('0.00')),
+    }
+
+
+def _line_json(line):
+    return {
+        'line_id': line.id,
+        'product_id': line.product_id,
+        'quantity': line.quantity,
+        'stock': line.product.stock if line.product else 0,
+    }
+
+
+def _cart_summary(order, lines):
+    return {'cart': _cart_json(order), 'items': [_line_json(line) for line in lines]}
+
+
+@require_POST
+def add_to_cart_batch(request):
+    """Añade varios productos al carrito en una petición y devuelve el resumen en JSON.
+
+    Cuerpo: `{"items": [{"product_id": 1, "quantity": 2}, ...]}` (también se
+    admiten pares `[1, 2]`).
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        raw_items = payload.get('items') if isinstance(payload, dict) else None
+        if not isinstance(raw_items, list) or not raw_items or len(raw_items) > MAX_BATCH_ITEMS:
+            raise ValueError
+        items = []
+        for item in raw_items:
+            if isinstance(item, dict):
+                product_id, quantity = item['product_id'], item.get('quantity', 1)
+            else:
+                product_id, quantity = item
+            product_id = int(product_id)
+            if not 0 < product_id <= MAX_DB_INTEGER:
+                raise ValueError
+            items.append((product_id, quantity))
+    except (ValueError, TypeError, KeyError, OverflowError):
+        return JsonResponse({'error': 'invalid_items'}, status=400)
+
+    products = Product.objects.in_bulk({product_id for product_id, _ in items})
+    order, lines, anon_cookie = ProductService.add_products_to_cart(request, items, products=products)
+    RequestCart.for_request(request).invalidate()
+
+    for line in lines.values():
+        line.product = products[line.product_id]
+    data = _cart_summary(order, lines.values())
+    data['skipped'] = sorted({product_id for product_id, _ in items} - set(lines))
+    resp = JsonResponse(data)
+    if anon_cookie:
+        resp.set_cookie('anon_user_id', anon_cookie, max_age=ANON_COOKIE_MAX_AGE)
+    return resp
+
+
+@require_POST
+async def add_to_cart_json(request, product_id):
+    """Versión JSON de `add_to_cart`: devuelve la línea y los totales en vez de redirigir."""
+    product = await Product.objects.filter(id=product_id).afirst()
+    if product is None:
+        return JsonResponse({'error': 'not_found'}, status=404)
+
+    order, line, anon_cookie = await ProductService.aadd_product_to_cart(request, product, request.POST.get('quantity', 1))
+    if line is not None:
+        line.product = product
+    resp = JsonResponse({
+        'cart': _cart_json(order),
+        'line': _line_json(line) if line else None,
+        'stock': product.stock,
+    })
+    if anon_cookie:
+        resp.set_cookie('anon_user_id', anon_cookie, max_age=ANON_COOKIE_MAX_AGE)
+    return resp
+
+
+async def _cart_line_json(request, item_id, change):
+    order = await ProductService.aget_cart(request)
+    if order is None:
+        return JsonResponse({'error': 'not_found'}, status=404)
+    try:
+        line = await change(order, item_id)
+    except OrderProduct.DoesNotExist:
+        return JsonResponse({'error': 'not_found'}, status=404)
+    return JsonResponse({'cart': _cart_json(order), 'line': _line_json(line)})
+
+
+@require_POST
+async def remove_from_cart_json(request, item_id):
+    """Resta una unidad de una línea del carrito de la petición (la borra al llegar a 0)."""
+    return await _cart_line_json(request, item_id, ProductService.aremove_one_from_cart)
+
+
+@require_POST
+async def update_cart_line_json(request, item_id):
+    """Fija la cantidad de una línea del carrito de la petición (`quantity=0` la borra)."""
+    try:
+        quantity = int(request.POST.get('quantity', ''))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'invalid_quantity'}, status=400)
+    return await _cart_line_json(
+        request, item_id,
+        lambda order, line_id: ProductService.aset_line_quantity(order, line_id, quantity),
+    )
+
+
 def view_cart(request):
-    order = list_user_cart_order(request)
+    cart = RequestCart.for_request(request)
     cart_items = []
     total_price = Decimal('0.00')
-    if order:
-        cart_items, total_price = _prepare_order_lines(order)
+    if cart.order:
+        cart_items, total_price = _prepare_order_lines(cart.order, lines=cart.lines)
 
     total_price_display = _format_price(total_price)
 
@@ -127,31 +240,35 @@ def remove_from_cart(request, item_id):
     result = ProductService.remove_product_from_cart(item_id)
     return redirect('view_cart')
 
+def _return_to_cart(order):
+    """Devuelve al carrito un pedido cuyo pago ha fallado y retorna el carrito resultante.
+
+    Si entretanto el cliente ha abierto otro carrito (otra pestaña), las
+    líneas del pedido se funden en ese en vez de violar `unique_active_cart_*`.
+    """
+    order.status = 'EN_CARRITO'
+    try:
+        with transaction.atomic():
+            order.save()
+        return order
+    except IntegrityError:
+        if order.registered_user_id:
+            owner = {'registered_user_id': order.registered_user_id}
+        else:
+            owner = {'anonymous_user_cookie': order.anonymous_user_cookie}
+        with transaction.atomic():
+            cart = Order.objects.get(status='EN_CARRITO', **owner)
+            merge_cart_lines(order, cart)
+        return cart
+
+
 def _mark_order_as_paid(order):
     """Marca un orden como pagado y actualiza el stock. Retorna (success, removed_items)."""
     if order.is_paid:
         return True, []
-    
-    shortages = []
-    lines = OrderProduct.objects.filter(order=order)
-    
-    for line in lines:
-        prod = line.product
-        qty = int(line.quantity or 0)
-        available = int(prod.stock or 0)
-        if qty > available:
-            shortages.append({
-                'line_id': line.id,
-                'product_id': prod.id,
-                'product_ref': prod.ref,
-                'product_name': prod.name,
-                'quantity_requested': qty,
-                'available': available,
-            })
-    
-    if shortages:
-        return False, shortages
-    
+
+    lines = list(OrderProduct.objects.filter(order=order).select_related('product'))
+
     # Generar ID único si no existe
     if not order.order_identified:
         for _ in range(10):
@@ -161,31 +278,34 @@ def _mark_order_as_paid(order):
                 break
         else:
             order.order_identified = f"ORD-{int(datetime.datetime.utcnow().timestamp())}-{uuid.uuid4().hex[:6].upper()}"
-    
-    # Reducir stock de productos
-    with transaction.atomic():
-        for line in lines:
-            prod = line.product
-            qty = int(line.quantity or 0)
-            if qty > 0:
-                new_stock = max((prod.stock or 0) - qty, 0)
-                prod.stock = new_stock
-                prod.save()
-        
-        order.is_paid = True
-        order.save()
-    
+
+    # Marcar como pagado con un UPDATE condicional: si otra petición (doble envío)
+    # ya lo hizo no afecta a ninguna fila y el stock no se reserva dos veces.
+    # Si falta stock se revierte todo, también el is_paid
+    try:
+        with transaction.atomic():
+            claimed = Order.objects.filter(pk=order.pk, is_paid=False).update(is_paid=True)
+            if claimed:
+                ProductService.reserve_stock(lines)
+                order.is_paid = True
+                order.save()
+    except InsufficientStockError as e:
+        return False, e.removed
+
+    if not claimed:
+        order.refresh_from_db(fields=['is_paid', 'order_identified'])
     return True, []
 
 
 def finalize_order(request):
-    order = list_user_cart_order(request)
+    cart = RequestCart.for_request(request)
+    order = cart.order
 
     if not order:
         messages.error(request, 'No hay ningún pedido en el carrito para finalizar.')
         return redirect('list_products')
 
-    lines, total_price = _prepare_order_lines(order)
+    lines, total_price = _prepare_order_lines(order, lines=cart.lines)
 
     if request.method == 'GET':
         form = OrderForm(instance=order)
@@ -206,16 +326,17 @@ def finalize_order(request):
     order = form.save(commit=False)
     order.status = 'SOLICITADO'
     order.save()
+    cart.invalidate()
 
     success, removed_items = _mark_order_as_paid(order)
     
     if not success:
-        order.status = 'EN_CARRITO'
-        order.save()
-        
         removed_ids = [item['line_id'] for item in removed_items]
         if removed_ids:
             OrderProduct.objects.filter(id__in=removed_ids).delete()
+        order = _return_to_cart(order)
+        if removed_ids:
+            order.refresh_totals()
         
         item_texts = []
         for item in removed_items:
@@ -249,11 +370,13 @@ def show_orders(request):
     if status:
         qs = qs.filter(status=status)
 
+    visible_lines = Q(order_products__product__is_active=True)
     qs = qs.annotate(
         total_quantity=Coalesce(
-            Sum('order_products__quantity', filter=Q(order_products__product__isnull=False) & ~Q(order_products__product__name='(producto eliminado)')),
+            Sum('order_products__quantity', filter=visible_lines),
             0
-        )
+        ),
+        order_total=_order_total_expression(visible_lines),
     )
 
     page_number = request.GET.get('page', 1)
@@ -261,9 +384,7 @@ def show_orders(request):
     orders = paginator.get_page(page_number)
 
     for order in orders:
-        _, total_price = _prepare_order_lines(order, exclude_deleted=True)
-        total_price_display = _format_price(total_price)
-        setattr(order, 'total_price', total_price_display)
+        setattr(order, 'total_price', _format_price(order.order_total))
 
     context = {
         'orders': orders,
@@ -293,16 +414,17 @@ def show_orders_admin(request):
     if q:
         qs = qs.filter(solicitant_name__icontains=q)
 
-    qs = qs.annotate(total_quantity=Coalesce(Sum('order_products__quantity'), 0))
+    qs = qs.annotate(
+        total_quantity=Coalesce(Sum('order_products__quantity'), 0),
+        order_total=_order_total_expression(),
+    )
 
     page_number = request.GET.get('page', 1)
     paginator = Paginator(qs.order_by('-date'), per_page)
     orders = paginator.get_page(page_number)
 
     for pedido in orders:
-        _, total_price = _prepare_order_lines(pedido)
-        total_price_display = _format_price(total_price)
-        setattr(pedido, 'total_price', total_price_display)
+        setattr(pedido, 'total_price', _format_price(pedido.order_total))
 
     context = {
         'orders': orders,
@@ -320,8 +442,13 @@ def edit_order(request, order_id):
 
     if new_status in dict(Order.STATUS_CHOICES).keys():
         order.status = new_status
-    
-    order.save()
+
+    try:
+        with transaction.atomic():
+            order.save()
+    except IntegrityError:
+        # `unique_active_cart_*`: el cliente ya tiene otro carrito activo
+        messages.error(request, f'No se puede devolver el pedido {order.id} al carrito: el cliente ya tiene un carrito activo.')
     return redirect('show_orders_admin')
 
 
@@ -0,0 +1,23 @@
+"""Sello de versión del catálogo para la caché de fragmentos de `products.html`.
+
+Las tarjetas de producto se cachean con `{% cache %}` usando como clave el id
+del producto y este sello; al guardar o borrar un `Product` se cambia el
+sello y todas las tarjetas antiguas dejan de usarse.
+"""
+import time
+
+from django.core.cache import cache
+
+
+VERSION_KEY = 'products:catalog_version'
+
+# Las tarjetas no dependen del usuario, así que pueden vivir mucho tiempo
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+def catalog_version():
+    return cache.get_or_set(VERSION_KEY, lambda: str(time.time_ns()), None)
+
+
+def bump_catalog_version():
+    cache.set(VERSION_KEY, str(time.time_ns()), None)
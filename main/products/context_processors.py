@@ -1,16 +1,8 @@
-from django.db.models import Sum
-from main.orders.models import OrderProduct
-from main.orders.service import ProductService
+from main.orders.cart import RequestCart
  
 
 def cart_status(request):
-    item_count = 0
-    
-    order = ProductService.get_active_cart_for_request(request)
-
-    if order:
-        result = OrderProduct.objects.filter(order=order).aggregate(total=Sum('quantity'))
-        item_count = result['total'] or 0
+    item_count = RequestCart.for_request(request).item_count
 
     return {
         'cart_has_items': item_count > 0,
@@ -2,6 +2,7 @@ from django import forms
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 import re
+from main import images
 from .models import Product
 
 class ProductForm(forms.ModelForm):
@@ -50,4 +51,15 @@ class ProductForm(forms.ModelForm):
             raise forms.ValidationError('Introduce un número entero válido para el stock.')
         if stock_int < 0:
             raise forms.ValidationError('El stock no puede ser negativo.')
-        return stock_int
\ No newline at end of file
+        return stock_int
+
+    def save(self, commit=True):
+        product = super().save(commit)
+        if commit:
+            self.generate_image_variants()
+        return product
+
+    def generate_image_variants(self):
+        """Genera las miniaturas WebP si se ha subido una imagen nueva."""
+        if 'image' in self.changed_data and self.instance.image:
+            images.generate_variants(self.instance.image.name, self.instance.image.storage)
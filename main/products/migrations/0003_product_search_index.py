@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+FTS_TABLE = 'products_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    # SQL propio de la migración: no depende de main.products.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, flavor, size, ref, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite compilado sin FTS5: la búsqueda usará icontains
+            return
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, flavor, size, ref) "
+            f"SELECT id, name, COALESCE(flavor, ''), COALESCE(size, ''), COALESCE(ref, '') FROM products_product"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_remove_orderproduct_order_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
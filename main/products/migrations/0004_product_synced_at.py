@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last CSV sync'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:54
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+SENTINEL_NAME = '(producto eliminado)'
+
+
+def archive_sentinel_products(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(name=SENTINEL_NAME).update(is_active=False, deleted_at=timezone.now(), stock=0)
+
+
+def restore_sentinel_products(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(name=SENTINEL_NAME).update(is_active=True, deleted_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_synced_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Archived at'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Active'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='product_active_idx'),
+        ),
+        migrations.RunPython(archive_sentinel_products, restore_sentinel_products),
+    ]
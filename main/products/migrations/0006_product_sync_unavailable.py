@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sync_unavailable',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Unavailable in CSV sync'),
+        ),
+    ]
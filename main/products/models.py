@@ -1,6 +1,16 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
 
+class ActiveProductManager(models.Manager):
+    """Manager por defecto: solo productos no archivados."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_active=True)
+
 
 class Product(models.Model):
     name = models.CharField(max_length=200, verbose_name="Name")
@@ -10,11 +20,45 @@ class Product(models.Model):
     size = models.CharField(max_length=100, blank=True, null=True, verbose_name="Size")
     image = models.ImageField(upload_to='products', blank=True, null=True)
     stock = models.PositiveIntegerField(default=10, verbose_name="Stock Quantity")
+    synced_at = models.DateTimeField(blank=True, null=True, editable=False, verbose_name="Last CSV sync")
+    # La sincronización lo puso a stock 0; se repone si vuelve a estar disponible
+    sync_unavailable = models.BooleanField(default=False, editable=False, verbose_name="Unavailable in CSV sync")
+    is_active = models.BooleanField(default=True, verbose_name="Active")
+    deleted_at = models.DateTimeField(blank=True, null=True, verbose_name="Archived at")
+
+    objects = ActiveProductManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        indexes = [
+            # Índice parcial: el listado del staff recorre los productos activos
+            # por nombre; el catálogo público va por id y le basta la clave primaria
+            models.Index(fields=['name'], condition=Q(is_active=True), name='product_active_name_idx'),
+        ]
 
     def _str_(self):
         return self.name
 
+    def archive(self):
+        """Archiva el producto en lugar de borrarlo; el historial de pedidos lo conserva."""
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['is_active', 'deleted_at'])
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, **kwargs):
+    from main.products import catalog_cache, search, suggest
+    search.index_product(instance)
+    suggest.invalidate()
+    catalog_cache.bump_catalog_version()
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_on_delete(sender, instance, **kwargs):
+    from main.products import catalog_cache, search, suggest
+    search.remove_product(instance.pk)
+    suggest.invalidate()
+    catalog_cache.bump_catalog_version()
@@ -0,0 +1,132 @@
+"""Búsqueda de productos sobre un índice FTS5 de SQLite.
+
+El índice (`products_product_fts`) contiene nombre, sabor, tamaño y referencia
+de cada producto, con el tokenizador `unicode61 remove_diacritics 2` para que
+"formula" encuentre "Fórmula". Se mantiene sincronizado con las señales
+`post_save`/`post_delete` de `Product`; tras cargas masivas (`bulk_create`)
+hay que llamar a `rebuild_index()`.
+
+La tabla la crea la migración `0003_product_search_index` si el SQLite
+enlazado trae FTS5. Si la base de datos no es SQLite o no tiene FTS5 se
+recurre a `icontains`.
+"""
+import functools
+import re
+import sqlite3
+import unicodedata
+from contextlib import closing
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+
+FTS_TABLE = 'products_product_fts'
+PRODUCT_TABLE = 'products_product'
+
+# Pesos bm25 de cada columna: name, flavor, size, ref
+RANK_EXPRESSION = f"bm25({FTS_TABLE}, 10.0, 4.0, 2.0, 1.0)"
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    """Minúsculas y sin tildes, igual que el tokenizador del índice."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def build_match_query(q):
+    """Convierte la búsqueda del usuario en una expresión MATCH de prefijos.
+
+    Cada palabra se entrecomilla (para que la sintaxis de FTS5 no se
+    interprete) y se busca como prefijo; todas deben aparecer.
+    """
+    tokens = tokenize(q)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+@functools.lru_cache(maxsize=None)
+def sqlite_has_fts5():
+    """Si la librería SQLite del proceso está compilada con FTS5."""
+    with closing(sqlite3.connect(':memory:')) as conn:
+        try:
+            conn.execute("CREATE VIRTUAL TABLE probe USING fts5(x)")
+        except sqlite3.OperationalError:
+            return False
+    return True
+
+
+def fts_enabled(conn=connection):
+    return conn.vendor == 'sqlite' and sqlite_has_fts5()
+
+
+def rebuild_index(conn=connection):
+    from main.products import catalog_cache, suggest
+    suggest.invalidate()
+    catalog_cache.bump_catalog_version()
+    if not fts_enabled(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, flavor, size, ref) "
+            f"SELECT id, name, COALESCE(flavor, ''), COALESCE(size, ''), COALESCE(ref, '') FROM {PRODUCT_TABLE}"
+        )
+
+
+def index_product(product):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, flavor, size, ref) VALUES (%s, %s, %s, %s, %s)",
+            [product.pk, product.name, product.flavor or '', product.size or '', product.ref or ''],
+        )
+
+
+def remove_product(product_id):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def icontains_filter(q):
+    return Q(name__icontains=q) | Q(flavor__icontains=q) | Q(size__icontains=q) | Q(ref__icontains=q)
+
+
+def search_products(queryset, q):
+    """Filtra `queryset` por `q` y lo ordena por relevancia.
+
+    Con FTS5 disponible filtra con MATCH y anota `search_rank` (bm25);
+    si no, usa `icontains` sobre nombre, sabor, tamaño y referencia.
+    """
+    match = build_match_query(q)
+    if match is None:
+        return queryset.order_by('id')
+    if not fts_enabled():
+        return queryset.filter(icontains_filter(q)).order_by('id')
+
+    matching = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+    queryset = queryset.filter(id__in=matching)
+    if sqlite3.sqlite_version_info < (3, 35):
+        # Sin CTE MATERIALIZED el ranking repetiría el MATCH por cada fila
+        return queryset.order_by('id')
+    # bm25 solo existe dentro de una consulta MATCH: la CTE materializada lo
+    # calcula una sola vez y la subconsulta correlacionada solo la consulta
+    rank = RawSQL(
+        f"WITH ranked AS MATERIALIZED ("
+        f"SELECT rowid AS id, {RANK_EXPRESSION} AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        f") SELECT rank FROM ranked WHERE ranked.id = {PRODUCT_TABLE}.id",
+        [match],
+        output_field=FloatField(),
+    )
+    return queryset.annotate(search_rank=rank).order_by('search_rank', 'id')
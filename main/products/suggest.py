@@ -0,0 +1,104 @@
+"""Sugerencias de búsqueda (search-as-you-type) para el catálogo.
+
+Se construye en memoria un array ordenado de (palabra normalizada, id de
+producto) a partir de `Product`; cada consulta es un `bisect` sobre ese
+array, sin pasar por el ORM. El índice va ligado a la versión del catálogo
+(`catalog_cache.catalog_version`), que cambia al guardar o borrar un
+producto (señales en `models.py`); si no coincide se reconstruye en la
+siguiente petición. Como la versión vive en la caché compartida, un cambio
+hecho en otro proceso también invalida el índice de este.
+"""
+import heapq
+import threading
+from bisect import bisect_left
+
+from main.products.search import normalize, tokenize
+
+
+class SuggestIndex:
+
+    def __init__(self, products):
+        self.products = {}
+        self.tokens = {}
+        keys = []
+        for p in products:
+            name_tokens = tokenize(p['name'])
+            extra_tokens = tokenize(p.get('flavor') or '')
+            self.products[p['id']] = {
+                'id': p['id'],
+                'name': p['name'],
+                'flavor': p.get('flavor') or '',
+                'price': f"{p['price']:.2f}",
+                '_normalized': normalize(p['name']),
+            }
+            self.tokens[p['id']] = name_tokens + extra_tokens
+            for token in set(name_tokens + extra_tokens):
+                keys.append((token, p['id']))
+        keys.sort()
+        self._words = [k[0] for k in keys]
+        self._ids = [k[1] for k in keys]
+        # Orden estático de desempate: nombres cortos primero
+        self._rank = {pid: (len(p['name']), p['name'], pid) for pid, p in self.products.items()}
+        self._memo = {}
+
+    def _ids_with_prefix(self, prefix):
+        start = bisect_left(self._words, prefix)
+        end = bisect_left(self._words, prefix + '\uffff', start)
+        return set(self._ids[start:end])
+
+    def suggest(self, q, limit=8):
+        query = ' '.join(tokenize(q))
+        if not query:
+            return []
+        key = (query, limit)
+        if key not in self._memo:
+            if len(self._memo) > 1024:
+                self._memo.clear()
+            self._memo[key] = self._suggest(query.split(), query, limit)
+        return self._memo[key]
+
+    def _suggest(self, terms, query, limit):
+        # La palabra más larga acota más los candidatos; el resto se comprueba después
+        pivot = max(terms, key=len)
+        candidates = self._ids_with_prefix(pivot)
+        others = [t for t in terms if t != pivot]
+        if others:
+            candidates = {
+                pid for pid in candidates
+                if all(any(tok.startswith(t) for tok in self.tokens[pid]) for t in others)
+            }
+
+        best = heapq.nsmallest(
+            limit,
+            candidates,
+            key=lambda pid: (not self.products[pid]['_normalized'].startswith(query), self._rank[pid]),
+        )
+        return [{k: v for k, v in self.products[pid].items() if not k.startswith('_')} for pid in best]
+
+
+# (versión del catálogo con la que se construyó, índice)
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    from main.products import catalog_cache
+    # La versión se lee antes que los productos: si cambian mientras se
+    # construye, el índice queda con la versión vieja y se rehace en la siguiente
+    version = catalog_cache.catalog_version()
+    current = _index
+    if current is None or current[0] != version:
+        with _lock:
+            current = _index
+            if current is None or current[0] != version:
+                from main.products.models import Product
+                rows = Product.objects.values('id', 'name', 'flavor', 'price')
+                current = (version, SuggestIndex(rows))
+                _index = current
+    return current[1]
+
+
+def invalidate():
+    from main.products import catalog_cache
+    catalog_cache.bump_catalog_version()
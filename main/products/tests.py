@@ -1,10 +1,27 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.contrib.auth import get_user_model
 from main.orders.models import Order, OrderProduct
 from main.products.models import Product
+from main.products import suggest
+from main.products.catalog_cache import catalog_version
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from main.products.search import search_products
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from decimal import Decimal
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
+from PIL import Image
+from django.core.management import call_command
+from django.test import override_settings
+from main import images
+from main.products.forms import ProductForm
+from unittest.mock import patch
 
 
 class ProductViewsTests(TestCase):
@@ -53,6 +70,40 @@ class ProductViewsTests(TestCase):
 		self.assertEqual(apple.available_stock, max(apple.stock - 2, 0))
 		self.assertEqual(apple.max_add, max(apple.stock - 2, 0))
 
+	def test_list_products_paginates_annotated_queryset(self):
+		for i in range(30):
+			Product.objects.create(name=f'Bulk {i}', price=1.00, stock=4)
+		last = Product.objects.order_by('-id').first()
+
+		order = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+		OrderProduct.objects.create(order=order, product=last, quantity=3, price_at_order=last.price)
+
+		self.client.login(username='user', password='pass')
+		resp = self.client.get(reverse('list_products') + '?page=2')
+		self.assertEqual(resp.status_code, 200)
+		products_page = resp.context['products']
+		self.assertEqual(products_page.paginator.count, 33)
+		self.assertEqual(len(products_page.object_list), 12)
+
+		found = {p.id: p for p in products_page}
+		self.assertEqual(found[last.id].in_cart_qty, 3)
+		self.assertEqual(found[last.id].available_stock, 1)
+		self.assertEqual(found[last.id].max_add, 1)
+
+	def test_list_products_resolves_cart_once_per_request(self):
+		order = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
+		OrderProduct.objects.create(order=order, product=self.p1, quantity=2, price_at_order=self.p1.price)
+		order.refresh_totals()
+
+		self.client.login(username='user', password='pass')
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(reverse('list_products'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.context['cart_item_count'], 2)
+
+		cart_queries = [q['sql'] for q in ctx.captured_queries if 'FROM "orders_order"' in q['sql']]
+		self.assertEqual(len(cart_queries), 1)
+
 	def test_search_query_filters(self):
 		url = reverse('list_products') + '?q=ap'
 		resp = self.client.get(url)
@@ -154,22 +205,14 @@ class ProductViewsTests(TestCase):
 		resp = self.client.post(url)
 		self.assertEqual(resp.status_code, 404)
 
-	def test_delete_product_admin_post_deletes_cart_and_snapshots_history(self):
+	def test_delete_product_admin_archives_product_and_empties_carts(self):
 		p = Product.objects.create(name='ToDelete', price=2.50, stock=5)
-		img = SimpleUploadedFile('img.jpg', b'content', content_type='image/jpeg')
-		p.image.save('img.jpg', img)
-		p.save()
 
 		cart = Order.objects.create(status='EN_CARRITO', registered_user=self.user)
 		hist = Order.objects.create(status='SOLICITADO', registered_user=self.user)
 
 		OrderProduct.objects.create(order=cart, product=p, quantity=2, price_at_order=p.price)
-
-		inst = OrderProduct(order=hist, product=p, quantity=1)
-		OrderProduct.objects.bulk_create([inst])
-		h_line = OrderProduct.objects.filter(order=hist, product=p).first()
-
-		expected_image = getattr(p.image, 'url', None) or getattr(p.image, 'name', None)
+		h_line = OrderProduct.objects.create(order=hist, product=p, quantity=1)
 
 		self.client.login(username='staff', password='pass')
 		url = reverse('delete_product_admin', args=[p.id])
@@ -177,15 +220,20 @@ class ProductViewsTests(TestCase):
 		self.assertEqual(resp.status_code, 200)
 
 		self.assertFalse(Product.objects.filter(id=p.id).exists())
+		archived = Product.all_objects.get(id=p.id)
+		self.assertFalse(archived.is_active)
+		self.assertIsNotNone(archived.deleted_at)
 
 		self.assertFalse(OrderProduct.objects.filter(order=cart).exists())
+		cart.refresh_from_db()
+		self.assertEqual(cart.item_count, 0)
 
 		h = OrderProduct.objects.get(id=h_line.id)
-		self.assertIsNone(h.product)
+		self.assertEqual(h.product_id, p.id)
 		self.assertEqual(h.product_name, 'ToDelete')
-		self.assertEqual(h.product_image, expected_image)
-		p_price_dec = Decimal(str(p.price))
-		self.assertEqual(h.price_at_order.quantize(Decimal('0.01')), p_price_dec.quantize(Decimal('0.01')))
+
+		resp = self.client.get(reverse('list_products'))
+		self.assertNotContains(resp, 'ToDelete')
 
 	def test_delete_product_admin_preserves_existing_snapshots(self):
 		p = Product.objects.create(name='KeepSnapshots', price=9.99, stock=2)
@@ -202,9 +250,210 @@ class ProductViewsTests(TestCase):
 		self.assertEqual(resp.status_code, 200)
 
 		h = OrderProduct.objects.get(id=h_line.id)
-		self.assertIsNone(h.product)
+		self.assertEqual(h.product_id, p.id)
 		self.assertEqual(h.product_name, old_name)
 		self.assertEqual(h.product_image, old_image)
 		self.assertEqual(h.price_at_order.quantize(Decimal('0.01')), old_price.quantize(Decimal('0.01')))
 	
-    
\ No newline at end of file
+    
+
+class ProductSearchTests(TestCase):
+	def setUp(self):
+		self.formula = Product.objects.create(name='Batido Fórmula 1', flavor='Vainilla cremosa', size='550 g', price=40.00, stock=5)
+		self.te = Product.objects.create(name='Bebida instantánea de té', flavor='Limón', size='50 g', price=20.00, stock=5)
+		self.barrita = Product.objects.create(name='Barritas proteicas', flavor='Vainilla y almendra', size='14 x 35 g', price=25.00, stock=5)
+
+	def _search(self, q):
+		return list(search_products(Product.objects.all(), q))
+
+	def test_search_is_accent_insensitive_and_prefix_based(self):
+		self.assertEqual(self._search('formula'), [self.formula])
+		self.assertEqual(self._search('FÓRM'), [self.formula])
+		self.assertEqual(self._search('te lim'), [self.te])
+
+	def test_search_matches_flavor_and_size_and_ranks_name_first(self):
+		results = self._search('vainilla')
+		self.assertEqual(set(results), {self.formula, self.barrita})
+		self.assertEqual(self._search('550'), [self.formula])
+
+		Product.objects.create(name='Vainilla pura', price=5.00, stock=5)
+		self.assertEqual(self._search('vainilla')[0].name, 'Vainilla pura')
+
+	def test_index_follows_product_updates_and_deletes(self):
+		self.te.name = 'Aloe concentrado'
+		self.te.save()
+		self.assertEqual(self._search('aloe'), [self.te])
+		self.assertEqual(self._search('bebida'), [])
+
+		self.te.delete()
+		self.assertEqual(self._search('aloe'), [])
+
+	def test_query_with_fts_syntax_characters_is_safe(self):
+		self.assertEqual(self._search('"barr* ('), [self.barrita])
+		self.assertEqual(self._search('***'), self._search(''))
+
+
+class ProductSuggestTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		suggest.invalidate()
+		self.formula = Product.objects.create(name='Batido Fórmula 1', flavor='Vainilla', price=40.00, stock=5)
+		self.fibra = Product.objects.create(name='Bebida de fibra activa', flavor='Manzana', price=22.50, stock=5)
+		self.barrita = Product.objects.create(name='Barritas proteicas', flavor='Vainilla y almendra', price=25.00, stock=5)
+
+	def test_suggest_returns_prefix_matches_as_json(self):
+		resp = self.client.get(reverse('suggest_products'), {'q': 'ba'})
+		self.assertEqual(resp.status_code, 200)
+		data = resp.json()
+		names = [r['name'] for r in data['results']]
+		self.assertEqual(names, ['Batido Fórmula 1', 'Barritas proteicas'])
+		self.assertEqual(data['results'][0]['price'], '40.00')
+
+		resp = self.client.get(reverse('suggest_products'), {'q': 'formu vain'})
+		self.assertEqual([r['id'] for r in resp.json()['results']], [self.formula.id])
+
+		resp = self.client.get(reverse('suggest_products'), {'q': ''})
+		self.assertEqual(resp.json()['results'], [])
+
+	def test_warm_index_answers_without_queries(self):
+		suggest.get_index()
+		with self.assertNumQueries(0):
+			results = suggest.get_index().suggest('vain', limit=1)
+		self.assertEqual(len(results), 1)
+
+	def test_index_is_invalidated_on_product_changes(self):
+		self.assertEqual(suggest.get_index().suggest('aloe'), [])
+		aloe = Product.objects.create(name='Aloe concentrado', price=30.00, stock=5)
+		self.assertEqual([r['id'] for r in suggest.get_index().suggest('aloe')], [aloe.id])
+
+		aloe.delete()
+		self.assertEqual(suggest.get_index().suggest('aloe'), [])
+
+	def test_index_built_during_a_change_is_rebuilt(self):
+		build = suggest.SuggestIndex
+
+		def build_then_change(rows):
+			index = build(rows)
+			# Otro proceso guarda un producto mientras se construye el índice
+			Product.objects.create(name='Aloe concentrado', price=30.00, stock=5)
+			return index
+
+		with patch.object(suggest, 'SuggestIndex', side_effect=build_then_change):
+			self.assertEqual(suggest.get_index().suggest('aloe'), [])
+		self.assertEqual(len(suggest.get_index().suggest('aloe')), 1)
+
+
+class ProductCardCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.product = Product.objects.create(name='Cached Tea', flavor='Limón', price=9.00, stock=5)
+
+	def _card_key(self, version):
+		return make_template_fragment_key('product_card', [self.product.id, version])
+
+	def test_cards_are_cached_and_cart_numbers_stay_per_user(self):
+		User = get_user_model()
+		user = User.objects.create_user(username='buyer', password='pass')
+		version = catalog_version()
+
+		resp = self.client.get(reverse('list_products'))
+		self.assertContains(resp, 'Cached Tea')
+		self.assertIsNotNone(cache.get(self._card_key(version)))
+
+		order = Order.objects.create(status='EN_CARRITO', registered_user=user)
+		OrderProduct.objects.create(order=order, product=self.product, quantity=4, price_at_order=self.product.price)
+		self.client.login(username='buyer', password='pass')
+		resp = self.client.get(reverse('list_products'))
+		self.assertContains(resp, 'Quedan pocas unidades (1)')
+		self.assertContains(resp, 'data-in-cart="4"')
+
+	def test_product_changes_bump_the_version(self):
+		version = catalog_version()
+		self.client.get(reverse('list_products'))
+
+		self.product.name = 'Renamed Tea'
+		self.product.save()
+		self.assertNotEqual(catalog_version(), version)
+
+		resp = self.client.get(reverse('list_products'))
+		self.assertContains(resp, 'Renamed Tea')
+		self.assertNotContains(resp, 'Cached Tea')
+
+
+def _png(width, height):
+	buf = BytesIO()
+	Image.new('RGB', (width, height), (200, 120, 40)).save(buf, 'PNG')
+	return buf.getvalue()
+
+
+class ProductImageVariantsTests(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+		settings_override = override_settings(MEDIA_ROOT=self.media_root)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+	def _create(self, width, height):
+		form = ProductForm(
+			{'name': 'Batido', 'price': '40.00', 'stock': 5},
+			{'image': SimpleUploadedFile('batido.png', _png(width, height), content_type='image/png')},
+		)
+		self.assertTrue(form.is_valid(), form.errors)
+		return form.save()
+
+	def test_upload_generates_webp_variants_without_upscaling(self):
+		product = self._create(500, 300)
+
+		self.assertEqual([w for w, _ in images.existing_variants(product.image.name)], [160, 320])
+		with Image.open(os.path.join(self.media_root, images.variant_name(product.image.name, 320))) as variant:
+			self.assertEqual((variant.format, variant.size), ('WEBP', (320, 192)))
+
+	def test_catalog_emits_srcset(self):
+		product = self._create(800, 800)
+
+		resp = self.client.get(reverse('list_products'))
+		self.assertContains(resp, f'{images.variant_name(product.image.url, 640)} 640w')
+		self.assertContains(resp, f'src="{product.image.url}"')
+
+	def test_backfill_command_generates_missing_variants(self):
+		product = Product.objects.create(name='Té', price=9.00)
+		product.image.save('te.png', SimpleUploadedFile('te.png', _png(400, 400)), save=True)
+		self.assertEqual(images.existing_variants(product.image.name), [])
+
+		out = StringIO()
+		call_command('generate_image_variants', workers=1, stdout=out)
+
+		self.assertEqual(len(images.existing_variants(product.image.name)), 2)
+		self.assertIn('Images with variants: 1/1', out.getvalue())
+
+
+class ProductArchiveTests(TestCase):
+	def setUp(self):
+		self.active = Product.objects.create(name='Active Tea', price=3.00, stock=5)
+		self.archived = Product.objects.create(name='Archived Tea', price=4.00, stock=5)
+		self.archived.archive()
+
+	def test_default_manager_hides_archived_products(self):
+		self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Active Tea'])
+		self.assertEqual(Product.all_objects.count(), 2)
+		self.assertEqual([p.name for p in search_products(Product.objects.all(), 'tea')], ['Active Tea'])
+		self.assertEqual([r['name'] for r in suggest.get_index().suggest('tea')], ['Active Tea'])
+
+	def test_admin_listing_uses_partial_name_index(self):
+		plan = Product.objects.order_by('name').explain()
+		self.assertIn('product_active_name_idx', plan)
+		self.assertNotIn('TEMP B-TREE', plan)
+
+	def test_archived_lines_are_left_out_of_order_totals(self):
+		User = get_user_model()
+		user = User.objects.create_user(username='hist', password='pass')
+		order = Order.objects.create(status='SOLICITADO', registered_user=user)
+		OrderProduct.objects.create(order=order, product=self.active, quantity=2, price_at_order=Decimal('3.00'))
+		OrderProduct.objects.create(order=order, product=self.archived, quantity=1, price_at_order=Decimal('4.00'))
+
+		self.client.login(username='hist', password='pass')
+		resp = self.client.get(reverse('show_orders'))
+		listed = resp.context['orders'][0]
+		self.assertEqual(listed.total_quantity, 2)
+		self.assertEqual(listed.order_total, Decimal('6.00'))
@@ -1,48 +1,78 @@
 from django.shortcuts import get_object_or_404, render, redirect
+from django.http import JsonResponse
 from django.contrib.auth.decorators import user_passes_test
 from django.core.paginator import Paginator
-from main.orders.models import OrderProduct
+from django.db.models import F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from main.orders.models import OrderProduct, remove_product_from_carts
 from main.orders.views import list_user_cart_order
 from .models import Product
+from .search import search_products
+from . import suggest
+from .catalog_cache import CARD_TIMEOUT, catalog_version
 from django.contrib import messages
-from .forms import ProductForm
 from django.db import transaction
+from .forms import ProductForm
 
 def is_admin(user):
     return user.is_active and user.is_staff
 
+
+def annotate_cart_stock(products, order):
+    """Anota `in_cart_qty`, `available_stock` y `max_add` en SQL.
+
+    La cantidad en carrito sale de una subconsulta sobre las líneas del
+    carrito activo, así el paginador solo materializa las filas de la página.
+    """
+    if order:
+        in_cart = Subquery(
+            OrderProduct.objects.filter(order=order, product=OuterRef('pk')).values('quantity')[:1],
+            output_field=IntegerField(),
+        )
+    else:
+        in_cart = Value(0)
+
+    products = products.annotate(in_cart_qty=Coalesce(in_cart, Value(0), output_field=IntegerField()))
+    return products.annotate(
+        available_stock=Greatest(F('stock') - F('in_cart_qty'), Value(0), output_field=IntegerField()),
+        max_add=F('available_stock'),
+    )
+
+
 def list_products(request):
     q = request.GET.get('q', '')
     q = q.strip() if isinstance(q, str) else ''
+    products = Product.objects.all()
     if q:
-        products = Product.objects.filter(name__icontains=q).exclude(name='(producto eliminado)')
+        products = search_products(products, q)
     else:
-        products = Product.objects.exclude(name='(producto eliminado)')
+        products = products.order_by('id')
 
-    cart_quantities = {}
     order = list_user_cart_order(request)
-    if order:
-        lines = OrderProduct.objects.filter(order=order).select_related('product')
-        for l in lines:
-            pid = getattr(l.product, 'id', None)
-            if pid is not None:
-                cart_quantities[pid] = l.quantity
-
-    product_list = []
-    for p in products:
-        in_cart = cart_quantities.get(p.id, 0)
-        max_add = max(p.stock - in_cart, 0)
-        setattr(p, 'in_cart_qty', in_cart)
-        setattr(p, 'available_stock', max(p.stock - in_cart, 0))
-        setattr(p, 'max_add', max_add)
-        product_list.append(p)
-
+    products = annotate_cart_stock(products, order)
 
     page_number = int(request.GET.get('page', 1))
-    paginator = Paginator(product_list, 21)
+    paginator = Paginator(products, 21)
     products_page = paginator.get_page(page_number)
 
-    return render(request, 'products.html', {'products': products_page, 'q': q})
+    return render(request, 'products.html', {
+        'products': products_page,
+        'q': q,
+        'catalog_version': catalog_version(),
+        'card_timeout': CARD_TIMEOUT,
+    })
+
+
+def suggest_products(request):
+    q = request.GET.get('q', '')
+    q = q.strip() if isinstance(q, str) else ''
+    try:
+        limit = min(max(int(request.GET.get('k', 8)), 1), 20)
+    except (TypeError, ValueError):
+        limit = 8
+
+    results = suggest.get_index().suggest(q, limit=limit) if q else []
+    return JsonResponse({'q': q, 'results': results})
 
 
 @user_passes_test(is_admin)
@@ -50,10 +80,11 @@ def show_product_admin(request):
     q = request.GET.get('q', '').strip()
     per_page = 21
 
-    qs = Product.objects.exclude(name='(producto eliminado)')
+    qs = Product.objects.all()
     if q:
-        qs = qs.filter(name__icontains=q)
-    qs = qs.order_by('name')
+        qs = search_products(qs, q)
+    else:
+        qs = qs.order_by('name')
 
     page_number = request.GET.get('page', 1)
     paginator = Paginator(qs, per_page)
@@ -71,8 +102,7 @@ def create_product_admin(request):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES)
         if form.is_valid():
-            prod = form.save(commit=False)
-            prod.save()
+            prod = form.save()
             messages.success(request, f"Producto '{prod.name}' creado correctamente.")
             return redirect('show_products_admin')
     else:
@@ -88,8 +118,7 @@ def edit_product_admin(request, product_id):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=prod)
         if form.is_valid():
-            prod = form.save(commit=False)
-            prod.save()
+            prod = form.save()
             messages.success(request, f"Producto '{prod.name}' actualizado correctamente.")
             return redirect('show_products_admin')
     else:
@@ -106,39 +135,10 @@ def delete_product_admin(request, product_id):
     prod = get_object_or_404(Product, id=product_id)
     prod_name = prod.name
 
-    def _snapshot_and_detach(product):
-        OrderProduct.objects.filter(product=product, order__status='EN_CARRITO').delete()
-
-        hist_qs = OrderProduct.objects.filter(product=product).exclude(order__status='EN_CARRITO')
-
-        img = getattr(product, 'image', None)
-        image_val = None
-        if img:
-            image_val = getattr(img, 'url', None) or getattr(img, 'name', None)
-
-        for line in hist_qs:
-            updated = False
-            if not getattr(line, 'product_name', None):
-                line.product_name = product.name
-                updated = True
-            if not getattr(line, 'product_image', None) and image_val:
-                line.product_image = image_val
-                updated = True
-            if not getattr(line, 'price_at_order', None):
-                try:
-                    line.price_at_order = product.price
-                    updated = True
-                except Exception:
-                    pass
-            if updated:
-                line.save()
-
-        with transaction.atomic():
-            hist_qs.update(product=None)
-
-    _snapshot_and_detach(prod)
-
-    prod.delete()
+    # Se archiva en lugar de borrarlo: el historial de pedidos sigue apuntando al producto
+    with transaction.atomic():
+        remove_product_from_carts(prod)
+        prod.archive()
     messages.success(request, f"Producto '{prod_name}' eliminado correctamente.")
     return redirect('show_products_admin')
 
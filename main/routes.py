@@ -1,21 +1,17 @@
 from django.contrib import admin
 from django.urls import include, path
-from django.conf import settings
 from main import views 
-from django.conf.urls.static import static
-from django.views.static import serve 
+from main.media import serve_media
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name='home'), 
     
-    path('media/<path:path>', serve, {'document_root': settings.MEDIA_ROOT}),
+    path('media/<path:path>', serve_media, name='media'),
 
     path('', include('main.user.routes')),
     path('', include('main.appointments.routes')),
     path('', include('main.orders.routes')),
     path('', include('main.products.routes')),
-]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
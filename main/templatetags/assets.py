@@ -0,0 +1,16 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from main.assets import bundle_path
+
+register = template.Library()
+
+
+@register.simple_tag
+def css_bundle(name):
+    """<link> al paquete de CSS `name` de `settings.CSS_BUNDLES`."""
+    if name not in settings.CSS_BUNDLES:
+        raise template.TemplateSyntaxError(f"Unknown CSS bundle '{name}'")
+    return format_html('<link rel="stylesheet" href="{}">', static(bundle_path(name)))
@@ -0,0 +1,17 @@
+from django import template
+
+from main import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_srcset(field_file):
+    """Valor de `srcset` con las variantes WebP de la imagen ("" si no hay)."""
+    if not field_file:
+        return ""
+    storage = field_file.storage
+    return ", ".join(
+        f"{storage.url(name)} {width}w"
+        for width, name in images.existing_variants(field_file.name, storage)
+    )
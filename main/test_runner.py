@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Runner de los tests: estáticos sin manifiesto.
+
+    Los tests no ejecutan `collectstatic`, así que el storage con hash de
+    producción no encontraría el manifiesto; se usa el de Django, que
+    devuelve la ruta tal cual. Los tests que prueban el manifiesto lo
+    vuelven a activar con `override_settings`.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+        self._static_storage = override_settings(STORAGES=storages)
+        self._static_storage.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._static_storage.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,356 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from main import assets, import_csv
+from main.products.models import Product
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    hits = {}
+    flaky_failures = {}
+
+    def do_GET(self):
+        _ImageHandler.hits[self.path] = _ImageHandler.hits.get(self.path, 0) + 1
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if _ImageHandler.flaky_failures.get(self.path, 0) > 0:
+            _ImageHandler.flaky_failures[self.path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = f"image:{self.path}".encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageDownloaderTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _ImageHandler.hits = {}
+        _ImageHandler.flaky_failures = {}
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def _download(self, urls):
+        return import_csv.descargar_imagenes(urls, workers=4, cache_dir=self.cache_dir, backoff=0)
+
+    def test_downloads_in_parallel_and_skips_failures(self):
+        urls = [f"{self.base_url}/img{i}.png" for i in range(10)] + [f"{self.base_url}/missing.png", 'no-es-url']
+        paths = self._download(urls)
+
+        self.assertEqual(len(paths), 10)
+        with open(paths[f"{self.base_url}/img3.png"], 'rb') as f:
+            self.assertEqual(f.read(), b'image:/img3.png')
+        self.assertNotIn(f"{self.base_url}/missing.png", paths)
+
+    def test_cached_images_are_not_downloaded_again(self):
+        urls = [f"{self.base_url}/a.png", f"{self.base_url}/b.png"]
+        self._download(urls)
+        self._download(urls + [f"{self.base_url}/c.png"])
+
+        self.assertEqual(_ImageHandler.hits, {'/a.png': 1, '/b.png': 1, '/c.png': 1})
+
+    def test_transient_errors_are_retried(self):
+        _ImageHandler.flaky_failures['/flaky.png'] = 2
+        paths = self._download([f"{self.base_url}/flaky.png"])
+
+        self.assertIn(f"{self.base_url}/flaky.png", paths)
+        self.assertEqual(_ImageHandler.hits['/flaky.png'], 3)
+
+    def test_importer_attaches_downloaded_images(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        csv_path = os.path.join(self.cache_dir, 'productos.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write('titulo,link,foto,disponible,descripcion,sabor,precio\n')
+            f.write(f'Batido,ref-1,{self.base_url}/batido.png,True,550 g,Vainilla,40.00\n')
+            f.write(f'Té,ref-2,{self.base_url}/missing.png,True,50 g,Limón,20.00\n')
+
+        with override_settings(MEDIA_ROOT=media_root), \
+                patch.object(import_csv, 'CSV_PATH', csv_path), \
+                patch.object(import_csv, 'IMAGE_CACHE_DIR', self.cache_dir):
+            import_csv.importar_productos_desde_csv()
+
+            batido = Product.objects.get(ref='ref-1')
+            self.assertTrue(batido.image.name.startswith('products/batido'))
+            self.assertFalse(Product.objects.get(ref='ref-2').image)
+
+
+class ProductSyncTests(TestCase):
+
+    HEADER = 'titulo,link,foto,disponible,descripcion,sabor,precio\n'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.csv_path = os.path.join(self.tmp, 'productos.csv')
+        for target, value in (('CSV_PATH', self.csv_path), ('IMAGE_CACHE_DIR', self.tmp), ('PRODUCTOS_PERSONALIZADOS', [])):
+            patcher = patch.object(import_csv, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Sin red: ninguna imagen se descarga
+        patcher = patch.object(import_csv, 'descargar_imagenes', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, *rows):
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write(self.HEADER)
+            for row in rows:
+                f.write(row + '\n')
+
+    def test_sync_creates_updates_and_marks_missing_unavailable(self):
+        kept = Product.objects.create(name='Batido', ref='ref-1', price='40.00', flavor='Vainilla', size='550 g')
+        changed = Product.objects.create(name='Té', ref='ref-2', price='20.00', flavor='Limón', size='50 g')
+        gone = Product.objects.create(name='Aloe', ref='ref-3', price='15.00', stock=7)
+        self._write(
+            'Batido,ref-1,x,True,550 g,Vainilla,40.00',
+            'Té,ref-2,x,True,50 g,Limón,22.50',
+            'Barritas,ref-4,x,True,,Chocolate,9.90',
+            'Barritas,ref-4,x,True,,Chocolate,9.90',
+            'Crema,ref-5,x,False,,,12.00',
+        )
+
+        result = import_csv.sincronizar_productos_desde_csv(batch_size=2)
+
+        self.assertEqual(result, {'creados': 2, 'actualizados': 1, 'sin_cambios': 1, 'invalidas': 0, 'no_disponibles': 1})
+        self.assertEqual(Product.objects.get(pk=changed.pk).price, Decimal('22.50'))
+        self.assertEqual(Product.objects.get(pk=gone.pk).stock, 0)
+        self.assertTrue(Product.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(Product.objects.filter(ref='ref-4').count(), 1)
+        self.assertEqual(Product.objects.get(ref='ref-5').stock, 0)
+
+    def test_unavailable_round_trip_restores_stock(self):
+        self._write('Batido,ref-1,x,True,550 g,Vainilla,40.00', 'Té,ref-2,x,True,50 g,Limón,20.00')
+        import_csv.sincronizar_productos_desde_csv()
+        self._write('Batido,ref-1,x,False,550 g,Vainilla,40.00')
+        import_csv.sincronizar_productos_desde_csv()
+        self.assertEqual(list(Product.objects.order_by('ref').values_list('stock', flat=True)), [0, 0])
+
+        self._write('Batido,ref-1,x,True,550 g,Vainilla,40.00', 'Té,ref-2,x,True,50 g,Limón,20.00')
+        result = import_csv.sincronizar_productos_desde_csv()
+
+        self.assertEqual(result['actualizados'], 2)
+        for p in Product.objects.all():
+            self.assertEqual((p.stock, p.sync_unavailable), (import_csv.STOCK_INICIAL, False))
+
+    def test_sold_out_product_is_not_restocked_by_sync(self):
+        sold_out = Product.objects.create(name='Batido', ref='ref-1', price='40.00', flavor='Vainilla', size='550 g', stock=0)
+        self._write('Batido,ref-1,x,True,550 g,Vainilla,40.00')
+
+        import_csv.sincronizar_productos_desde_csv()
+
+        self.assertEqual(Product.objects.get(pk=sold_out.pk).stock, 0)
+
+    def test_second_sync_is_a_no_op(self):
+        self._write('Batido,ref-1,x,True,550 g,Vainilla,40.00', 'Té,ref-2,x,True,50 g,Limón,20.00')
+        import_csv.sincronizar_productos_desde_csv()
+        ids = set(Product.objects.values_list('id', flat=True))
+
+        with self.assertNumQueries(5):
+            result = import_csv.sincronizar_productos_desde_csv()
+
+        self.assertEqual(result['sin_cambios'], 2)
+        self.assertEqual(result['creados'] + result['actualizados'], 0)
+        self.assertEqual(set(Product.objects.values_list('id', flat=True)), ids)
+
+    def test_rows_are_normalized_and_invalid_ones_skipped(self):
+        self._write(
+            '\u200b\u200bBarritas con  Proteínas\u200b,ref-1,x,True,,\u200bChocolate ,"9,90"',
+            'Té,ref-2,x,True,,,gratis',
+            ',ref-3,x,True,,,1.00',
+        )
+
+        result = import_csv.sincronizar_productos_desde_csv()
+
+        self.assertEqual((result['creados'], result['invalidas']), (1, 2))
+        p = Product.objects.get(ref='ref-1')
+        self.assertEqual((p.name, p.flavor, p.price), ('Barritas con Proteínas', 'Chocolate', Decimal('9.90')))
+
+    def test_pipeline_writes_fixed_size_chunks(self):
+        rows = (
+            {'titulo': f'Producto {i % 5}', 'link': f'ref-{i % 5}', 'foto': '', 'disponible': 'True',
+             'descripcion': '', 'sabor': '', 'precio': f'{i}.00'}
+            for i in range(7)
+        )
+        lotes = []
+        escribir = import_csv._escribir_lote
+
+        def espiar(filas, stamp):
+            lotes.append(len(filas))
+            return escribir(filas, stamp)
+
+        with patch.object(import_csv, '_escribir_lote', side_effect=espiar):
+            result = import_csv.importar_por_lotes(rows, batch_size=3)
+
+        self.assertEqual(lotes, [3, 3, 1])
+        self.assertEqual((result['creados'], result['actualizados']), (5, 2))
+        # Las referencias repetidas en lotes posteriores se quedan con la última fila
+        self.assertEqual(Product.objects.get(ref='ref-1').price, Decimal('6.00'))
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(self.media_root, 'products'))
+        self.body = bytes(range(256)) * 4
+        for name in ('foto.png', 'foto.3f2a9c1b7d4e.png'):
+            with open(os.path.join(self.media_root, 'products', name), 'wb') as f:
+                f.write(self.body)
+
+    def _get(self, path, headers=None):
+        return self.client.get(f'/media/{path}', headers=headers, HTTP_HOST='localhost')
+
+    def test_full_response_has_validators_and_cache_headers(self):
+        resp = self._get('products/foto.png')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b''.join(resp.streaming_content), self.body)
+        self.assertEqual(resp['Content-Type'], 'image/png')
+        self.assertEqual(resp['Content-Length'], str(len(self.body)))
+        self.assertIn('ETag', resp)
+        self.assertIn('Last-Modified', resp)
+        self.assertNotIn('immutable', resp['Cache-Control'])
+
+    def test_hashed_names_are_immutable(self):
+        resp = self._get('products/foto.3f2a9c1b7d4e.png')
+        self.assertEqual(resp['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_conditional_requests_return_304(self):
+        first = self._get('products/foto.png')
+
+        resp = self._get('products/foto.png', {'If-None-Match': first['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], first['ETag'])
+
+        resp = self._get('products/foto.png', {'If-Modified-Since': first['Last-Modified']})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_byte_ranges(self):
+        resp = self._get('products/foto.png', {'Range': 'bytes=10-19'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(b''.join(resp.streaming_content), self.body[10:20])
+        self.assertEqual(resp['Content-Range'], f'bytes 10-19/{len(self.body)}')
+
+        resp = self._get('products/foto.png', {'Range': 'bytes=-4'})
+        self.assertEqual(b''.join(resp.streaming_content), self.body[-4:])
+
+        resp = self._get('products/foto.png', {'Range': 'bytes=5000-'})
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp['Content-Range'], f'bytes */{len(self.body)}')
+
+        # Con un If-Range que ya no coincide se envía el fichero completo
+        resp = self._get('products/foto.png', {'Range': 'bytes=0-9', 'If-Range': '"otro"'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_missing_files_and_traversal_are_404(self):
+        self.assertEqual(self._get('products/nada.png').status_code, 404)
+        self.assertEqual(self._get('products').status_code, 404)
+        self.assertEqual(self._get('../manage.py').status_code, 404)
+
+
+class CssBundleTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        settings_override = override_settings(CSS_BUNDLES_DIR=os.path.join(self.tmp, 'build'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_minify_css(self):
+        css = "/* cabecera */\n.a ,\n.b {\n  color: red ;\n  margin: 0 auto;\n}\n"
+        self.assertEqual(assets.minify_css(css), '.a,.b{color: red;margin: 0 auto}')
+
+    def test_minify_css_keeps_quoted_strings(self):
+        css = '.a::before { content: "a  b /* x */" ; }\n.b { font-family: \'Open  Sans\' , serif; }'
+        self.assertEqual(assets.minify_css(css), '.a::before{content: "a  b /* x */"}.b{font-family: \'Open  Sans\',serif}')
+
+    def test_finder_builds_bundle_in_cascade_order(self):
+        path = finders.find('bundles/site.css')
+
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        sources = settings.CSS_BUNDLES['site']
+        positions = [content.index(f'/* {source} */') for source in sources]
+        self.assertEqual(positions, sorted(positions))
+        self.assertNotIn('styles/home.css', content)
+        self.assertIsNone(finders.find('bundles/desconocido.css'))
+
+    def test_pages_link_a_single_bundle(self):
+        resp = self.client.get(reverse('login'), HTTP_HOST='localhost')
+        self.assertContains(resp, 'bundles/site.css')
+        self.assertNotContains(resp, 'styles/products.css')
+
+        resp = self.client.get(reverse('home'), HTTP_HOST='localhost')
+        self.assertContains(resp, 'bundles/home.css')
+        self.assertNotContains(resp, 'bundles/site.css')
+
+        resp = self.client.get(reverse('list_products'), HTTP_HOST='localhost')
+        self.assertContains(resp, 'bundles/catalog.css')
+        self.assertNotContains(resp, 'bundles/site.css')
+
+    def test_bundles_only_carry_their_page_group(self):
+        site = settings.CSS_BUNDLES['site']
+        for sheet in ('styles/products.css', 'styles/finalize_order.css', 'styles/order_success.css',
+                      'styles/edit_products.css', 'styles/home.css'):
+            self.assertNotIn(sheet, site)
+        self.assertNotIn('styles/finalize_order.css', settings.CSS_BUNDLES['catalog'])
+        self.assertNotIn('styles/products.css', settings.CSS_BUNDLES['checkout'])
+        # Todas empiezan por las hojas comunes, en el mismo orden
+        for sources in settings.CSS_BUNDLES.values():
+            self.assertEqual(sources[:len(settings.CSS_BASE)], settings.CSS_BASE)
+
+    def test_collectstatic_emits_hashed_and_compressed_bundles(self):
+        static_root = os.path.join(self.tmp, 'static')
+        manifest = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}}
+        with override_settings(STATIC_ROOT=static_root, STORAGES=manifest):
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+            with open(os.path.join(static_root, 'staticfiles.json'), encoding='utf-8') as f:
+                hashed = json.load(f)['paths']['bundles/site.css']
+            self.assertTrue(os.path.exists(os.path.join(static_root, hashed + '.gz')))
+            self.assertEqual(static('bundles/site.css'), f'/static/{hashed}')
+            # Lo que no está en el manifiesto es un error, no una URL sin hash
+            with self.assertRaises(ValueError):
+                static('bundles/desconocido.css')
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 import re
+from main import images
 from .models import UserProfile 
 
 
@@ -95,4 +96,15 @@ class ProfileUpdateForm(forms.ModelForm):
         if not re.match(r'^\+?\d{9,15}$', phone):
             raise ValidationError(_("Introduce un número de teléfono válido."))
 
-        return phone
\ No newline at end of file
+        return phone
+
+    def save(self, commit=True):
+        profile = super().save(commit)
+        if commit:
+            self.generate_photo_variants()
+        return profile
+
+    def generate_photo_variants(self):
+        """Genera las miniaturas WebP si se ha subido una foto nueva."""
+        if 'photo' in self.changed_data and self.instance.photo:
+            images.generate_variants(self.instance.photo.name, self.instance.photo.storage)
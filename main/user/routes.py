@@ -1,8 +1,6 @@
 from django.urls import path
-from django.conf import settings
 from main.user import views
 from main.user import forms as user_forms
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
 
@@ -12,6 +10,4 @@ urlpatterns = [
     path('registro/', views.registration, name='registration'),
     path('perfil/', views.profile, name='profile'),
 
-]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
@@ -1,9 +1,14 @@
-from django.test import RequestFactory, TestCase
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.messages import get_messages
+from main import images
 from main.user.views import login
 from django.core.exceptions import ValidationError
 from main.user.validators import (
@@ -183,6 +188,11 @@ class ProfileViewTests(TestCase):
         self.assertTrue(any('¡Tu perfil ha sido actualizado!' in str(m) for m in messages))
 
     def test_profile_post_delete_photo_removes_file(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
         self.client.login(username=self.username, password=self.password)
         profile = self.user.userprofile
 
@@ -202,6 +212,25 @@ class ProfileViewTests(TestCase):
         profile.refresh_from_db()
         self.assertFalse(profile.photo)
 
+    def test_profile_photo_upload_generates_thumbnails(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        buf = BytesIO()
+        Image.new('RGB', (400, 400), (10, 20, 30)).save(buf, 'JPEG')
+        self.client.login(username=self.username, password=self.password)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('profile'), {
+                'first_name': '',
+                'last_name': '',
+                'phone': '',
+                'photo': SimpleUploadedFile('avatar.jpg', buf.getvalue(), content_type='image/jpeg'),
+            })
+            self.assertEqual(response.status_code, 302)
+            self.user.userprofile.refresh_from_db()
+            photo = self.user.userprofile.photo
+            self.assertEqual([w for w, _ in images.existing_variants(photo.name)], [160, 320])
+
 class ValidatorsTests(TestCase):
     def test_custom_user_similarity_allows_digits(self):
         v = CustomUserAttributeSimilarityValidator()
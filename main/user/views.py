@@ -2,6 +2,7 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 
+from main import images
 from main.user.models import UserProfile
 from .forms import ClientCreationForm, ClientLoginForm, UserUpdateForm, ProfileUpdateForm
 from django.contrib.auth import logout, login as auth_login
@@ -59,11 +60,13 @@ def profile(request):
             profile_obj = p_form.save(commit=False)
             
             if request.POST.get('delete_photo') == 'true':
+                images.delete_variants(profile_obj.photo.name)
                 profile_obj.photo.delete(save=False)
                 
                 profile_obj.photo = None 
             
             profile_obj.save()
+            p_form.generate_photo_variants()
             
             messages.success(request, '¡Tu perfil ha sido actualizado!')
             return redirect('profile')
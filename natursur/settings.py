@@ -90,6 +90,36 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Con REDIS_URL (p. ej. redis://localhost:6379/0) la caché es Redis, compartida
+# por todos los workers de gunicorn: la versión del catálogo, las tarjetas de
+# producto y el catálogo de citas son los mismos en todos los procesos. Sin ella
+# se usa la caché en memoria del proceso, válida si se despliega con un solo
+# proceso (y en desarrollo y tests).
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'natursur',
+            'OPTIONS': {
+                # Una tarjeta por producto: el límite por defecto (300) se queda corto
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -138,8 +168,42 @@ STATICFILES_DIRS = [
 # Directorio donde Django recolectará los archivos estáticos para producción (python manage.py collectstatic)
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
-# WhiteNoise: sirve los archivos estáticos directamente en producción
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# WhiteNoise: sirve los archivos estáticos directamente en producción, con
+# hash en el nombre y variantes precomprimidas (.gz/.br) generadas por collectstatic
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
+STATICFILES_FINDERS = [
+    "django.contrib.staticfiles.finders.FileSystemFinder",
+    "django.contrib.staticfiles.finders.AppDirectoriesFinder",
+    "main.assets.BundleFinder",
+]
+
+# Paquetes de CSS por grupo de páginas (se enlazan con {% css_bundle %}); el
+# orden de las hojas es el de la cascada. base.html usa 'site' (solo las hojas
+# comunes) y cada plantilla elige el de su grupo en el bloque `css_bundle`.
+# Las hojas de una sola página siguen enlazándose en `extra_head`.
+CSS_BASE = [
+    "styles/styles.css",
+    "styles/components.css",
+    "styles/footer.css",
+]
+
+CSS_BUNDLES = {
+    "site": CSS_BASE + ["styles/order.css"],
+    # Portada y fichas de pedido (.info-card)
+    "home": CSS_BASE + ["styles/home.css", "styles/order.css"],
+    # Catálogo, carrito y listado de productos del staff
+    "catalog": CSS_BASE + ["styles/order.css", "styles/products.css", "styles/edit_products.css"],
+    # Finalizar pedido y confirmación
+    "checkout": CSS_BASE + ["styles/order.css", "styles/finalize_order.css", "styles/order_success.css"],
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -152,6 +216,12 @@ MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
 
+# Carritos anónimos: duración de la cookie `anon_user_id` y antigüedad a partir
+# de la cual `manage.py reap_carts` los borra (programado con cron o el
+# planificador de la plataforma).
+ANONYMOUS_CART_TTL_DAYS = 30
+
+
 LOGIN_REDIRECT_URL = '/' 
 
 LOGOUT_REDIRECT_URL = '/'
@@ -179,4 +249,4 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'main.user.validators.CustomUserAttributeSimilarityValidator',
     },
 ]
-TEST_RUNNER = 'django.test.runner.DiscoverRunner'
\ No newline at end of file
+TEST_RUNNER = 'main.test_runner.TestRunner'
\ No newline at end of file